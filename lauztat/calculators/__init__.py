@@ -1,4 +1,5 @@
 #!/usr/bin/python
 
 from .asymptotic_calculator import AsymptoticCalculator
-from .frequentist_calculator import FrequentistCalculator
+from .frequentist_calculator import FrequentistCalculator, SequentialStopping
+from .frequentist_calculator import FitRecovery, ToyStats
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 # !/usr/bin/python
 
-from .calculator import Calculator
+from .calculator import Calculator, LRUCache
 from scipy.stats import norm
-from ..util import convert_dataset, eval_pdf
+from ..parameters import POI
+from ..util import convert_dataset, pdf_evaluator, hesse_error
 import numpy as np
+import heapq
 
 
 class AsymptoticCalculator(Calculator):
@@ -16,17 +18,104 @@ class AsymptoticCalculator(Calculator):
     likelihood- based tests of new physics. Eur. Phys. J., C71:1–19, 2011
     """
 
-    def __init__(self, config, nbins=100):
+    def __init__(self, config, nbins=100, npoints=3, tol=None,
+                 maxbins=1024, cache_size=1024, cache_file=None, wald=False,
+                 n_workers=1):
         """
         __init__ function
+
+        **Arguments:**
+            - **config** a lauztat.config.Config
+            - **nbins** number of bins of the Asimov datasets
+            - **npoints** number of points of the Gauss-Legendre quadrature
+            integrating the expected yields in each bin, 1 for the value at
+            the bin centre times the bin width.
+            - **tol** if given, the Asimov datasets are binned adaptively:
+            bins are split where the pdf varies until the Asimov negative
+            log-likelihood matches its integral within **tol**. The bins are
+            taken from a uniform binning with **maxbins** bins (a power of
+            2), merged where the pdf is flat, and **nbins** is not used.
+            - **cache_size** number of Asimov negative log-likelihood values
+            kept in memory.
+            - **cache_file** (optionnal) name of a shelve file where the
+            Asimov negative log-likelihood values are stored, to reuse them
+            in other sessions with the same configuration, identified by
+            **Config.fingerprint**. See **close**.
+            - **wald** if True the Wald approximation is used: q is
+            (poi - best fit)^2 / sigma^2, sigma being the uncertainty on the
+            parameter of interest from the Hessian at the best fit, for the
+            observed data and the Asimov datasets. No profile likelihood or
+            Asimov fit is done, see **wald_diagnostic** to check the
+            approximation.
+            - **n_workers** (optionnal) number of processes used to profile
+            the observed negative log-likelihood
         """
 
-        super(AsymptoticCalculator, self).__init__(config)
+        super(AsymptoticCalculator, self).__init__(config, n_workers)
 
         self._asymov_dataset = {}
         self._asymov_loss = {}
-        self._asymov_nll = {}
+        self._asymov_nll = LRUCache(cache_size, cache_file)
+        if cache_file is not None:
+            self._fingerprint = config.fingerprint()
+        else:
+            self._fingerprint = None
         self._nbins = nbins
+        self._npoints = npoints
+        self._tol = tol
+        self._maxbins = maxbins
+        self._evaluators = {}
+        self._wald = wald
+        self._sigma = {}
+
+    def _asimov_evaluator(self, i, model):
+        """
+        Returns the binning, the quadrature weights and the evaluator of the
+        pdf at the quadrature nodes of the model number **i**, built once for
+        all the Asimov datasets. With adaptive binning the pdf is also
+        evaluated at the edges and centres of the finest bins.
+        """
+        nbins = self._nbins if self._tol is None else self._maxbins
+        key = (i, nbins, self._npoints)
+
+        if key not in self._evaluators.keys():
+            centres, nodes, weights = asymov_binning(model.space, nbins,
+                                                     self._npoints)
+            edges = np.linspace(*model.space.limit1d, nbins+1)
+            if self._tol is not None:
+                nodes = np.concatenate([nodes, edges, centres])
+            evaluate = pdf_evaluator(model, nodes)
+            self._evaluators[key] = (edges, centres, weights, evaluate)
+
+        return self._evaluators[key]
+
+    def _asimov_yields(self, i, model, values):
+        """
+        Returns the bin centres and the expected yields of the Asimov dataset
+        of the model number **i** for the parameters **values**.
+        """
+        edges, centres, weights, evaluate = self._asimov_evaluator(i, model)
+        nbins = len(centres)
+
+        f = evaluate(values)
+        f_nodes = f[:len(weights)]
+
+        yields = (f_nodes * weights).reshape(nbins, -1).sum(axis=1)
+
+        if self._tol is None:
+            return centres, yields
+
+        f_edges = f[len(weights): len(weights) + nbins + 1]
+        f_centres = f[len(weights) + nbins + 1:]
+        flogf = f_nodes * np.log(np.where(f_nodes > 0, f_nodes, 1.))
+        flogf = (flogf * weights).reshape(nbins, -1).sum(axis=1)
+
+        centres, yields = adaptive_asymov_binning(edges, yields, flogf,
+                                                  f_edges, f_centres,
+                                                  self._tol)
+        print("Adaptive Asimov binning with {0} bins.".format(len(centres)))
+
+        return centres, yields
 
     def asymov_dataset(self, poi):
         if poi not in self._asymov_dataset.keys():
@@ -56,9 +145,8 @@ class AsymptoticCalculator(Calculator):
 
             asydatasets = []
 
-            for m in models:
-                space = m.space
-                asydatasets.append(generate_asymov_dataset(m, values, space, self._nbins))
+            for i, m in enumerate(models):
+                asydatasets.append(self._asimov_yields(i, m, values))
 
             self._asymov_dataset[poi] = asydatasets
 
@@ -81,19 +169,118 @@ class AsymptoticCalculator(Calculator):
 
         return self._asymov_loss[poi]
 
-    def asymov_nll(self, poi, poialt):
-        config = self.config
-        minimizer = config.minimizer
+    def _asymov_nll_key(self, poi, poialt):
+        binning = (self._nbins, self._npoints, self._tol, self._maxbins)
+        return (poi.name, float(poi.value), poialt.name, float(poialt.value),
+                binning, self._fingerprint)
+
+    def close(self):
+        """
+        Close the shelve file of the Asimov negative log-likelihood values.
+        """
+        self._asymov_nll.close()
 
+    def asymov_nll(self, poi, poialt):
+        """
+        Returns the negative log-likelihood of the Asimov dataset of the
+        alternative hypothesis **poialt**, profiled for the values of
+        **poi**.
+        """
         ret = np.empty(len(poi))
         for i, p in enumerate(poi):
-            if p not in self._asymov_nll.keys():
+            key = self._asymov_nll_key(p, poialt)
+            if key not in self._asymov_nll:
                 loss = self.asymov_loss(poialt)
-                nll = config.pll(minimizer, loss, p.parameter, p.value)
-                self._asymov_nll[p] = nll
-            ret[i] = self._asymov_nll[p]
+                nll = self.profile(loss, p.parameter, p.value)
+                self._asymov_nll[key] = nll
+            ret[i] = self._asymov_nll[key]
         return ret
 
+    def sigma(self, poiparam):
+        """
+        Returns the uncertainty on the parameter of interest **poiparam**
+        from the Hessian at the best fit.
+        """
+        if poiparam.name not in self._sigma.keys():
+            sigma = hesse_error(self.config.bestfit, poiparam)
+            self._sigma[poiparam.name] = sigma
+        return self._sigma[poiparam.name]
+
+    def _qwald(self, poi, bestfit, qtilde=False):
+        mu = np.atleast_1d(np.asarray(poi.value, dtype=float))
+        sigma = self.sigma(poi.parameter)
+        if qtilde and bestfit < 0:
+            return (mu**2 - 2*mu*bestfit) / sigma**2
+        else:
+            return (mu - bestfit)**2 / sigma**2
+
+    def qobs(self, poinull, onesided=True, onesideddiscovery=False,
+             qtilde=False):
+
+        if not self._wald:
+            return super(AsymptoticCalculator, self).qobs(
+                poinull, onesided=onesided,
+                onesideddiscovery=onesideddiscovery, qtilde=qtilde)
+
+        return self._qobs_wald(poinull, onesided, onesideddiscovery, qtilde)
+
+    def _qobs_wald(self, poinull, onesided=True, onesideddiscovery=False,
+                   qtilde=False):
+        """
+        Returns the Wald approximation of the observed test statistic, with
+        or without the **wald** option.
+        """
+        poiparam = poinull.parameter
+        bf = self.config.bestfit.params[poiparam]["value"]
+        qobs = self._qwald(poinull, bf, qtilde)
+        if qtilde and bf < 0:
+            bf = 0
+
+        return self.qdist(qobs, bf, poinull.value, onesided=onesided,
+                          onesideddiscovery=onesideddiscovery)
+
+    def _qalt(self, poinull, poialt):
+        """
+        Returns the test statistic of the Asimov dataset of **poialt** for
+        **poinull**.
+        """
+        if self._wald:
+            return self._qwald(poinull, poialt.value)
+
+        nll_poinull_asy = self.asymov_nll(poinull, poialt)
+        nll_poialt_asy = self.asymov_nll(poialt, poialt)
+        return self.q(nll_poinull_asy, nll_poialt_asy)
+
+    def wald_diagnostic(self, poinull, npoints=3, qtilde=False, tol=0.1,
+                        printlevel=1):
+        """
+        Compares the Wald approximation of the observed test statistic with
+        the profile likelihood ratio, for **npoints** values of **poinull**
+        spread over its range, with or without the **wald** option. Returns
+        a dictionnary with the values of the parameter of interest ("poi"),
+        the test statistics ("q_wald", "q_profile") and their difference in
+        significance ("zdiff", |sqrt(q_wald) - sqrt(q_profile)|). A warning
+        is printed if the difference is larger than **tol**.
+        """
+        values = np.atleast_1d(np.asarray(poinull.value, dtype=float))
+        index = np.unique(np.linspace(0, len(values) - 1, npoints).astype(int))
+        poi = POI(poinull.parameter, values[index])
+
+        kwargs = dict(onesided=False, qtilde=qtilde)
+        q_wald = self._qobs_wald(poi, **kwargs)
+        q_profile = super(AsymptoticCalculator, self).qobs(poi, **kwargs)
+
+        zdiff = np.abs(np.sqrt(np.maximum(q_wald, 0)) -
+                       np.sqrt(np.maximum(q_profile, 0)))
+
+        if printlevel > 0 and np.any(zdiff > tol):
+            msg = "Warning: the Wald approximation differs by up to {0:.2f} "
+            msg += "sigma from the profile likelihood ratio."
+            print(msg.format(np.max(zdiff)))
+
+        return {"poi": values[index], "q_wald": q_wald,
+                "q_profile": q_profile, "zdiff": zdiff}
+
     def pvalue(self, poinull, poialt=None, qtilde=False, onesided=True,
                onesideddiscovery=False):
 
@@ -105,9 +292,7 @@ class AsymptoticCalculator(Calculator):
         needpalt = poialt is not None
 
         if needpalt:
-            nll_poinull_asy = self.asymov_nll(poinull, poialt)
-            nll_poialt_asy = self.asymov_nll(poialt, poialt)
-            qalt = self.q(nll_poinull_asy, nll_poialt_asy)
+            qalt = self._qalt(poinull, poialt)
             qalt = self.qdist(qalt, 0, poinull.value, onesided=onesided,
                               onesideddiscovery=onesideddiscovery)
             sqrtqalt = np.sqrt(qalt)
@@ -144,10 +329,7 @@ class AsymptoticCalculator(Calculator):
 
     def expected_pvalue(self, poinull, poialt, nsigma, CLs=True):
 
-        nll_poinull_asy = self.asymov_nll(poinull, poialt)
-        nll_poialt_asy = self.asymov_nll(poialt, poialt)
-
-        qalt = self.q(nll_poinull_asy, nll_poialt_asy)
+        qalt = self._qalt(poinull, poialt)
         qalt = np.where(qalt < 0, 0, qalt)
 
         ret = []
@@ -165,10 +347,7 @@ class AsymptoticCalculator(Calculator):
     def expected_poi(self, poinull, poialt, nsigma, alpha=0.05,
                      CLs=False):
 
-        nll_poinull_asy = self.asymov_nll(poinull, poialt)
-        nll_poialt_asy = self.asymov_nll(poialt, poialt)
-
-        qalt = self.q(nll_poinull_asy, nll_poialt_asy)
+        qalt = self._qalt(poinull, poialt)
         qalt = np.where(qalt < 0, 0, qalt)
 
         sigma = np.sqrt((poinull.value - poialt.value)**2 / qalt)
@@ -185,16 +364,96 @@ class AsymptoticCalculator(Calculator):
         return ret
 
 
-def generate_asymov_dataset(model, params, space, nbins=100):
-
+def asymov_binning(space, nbins=100, npoints=1):
+    """
+    Returns the centres of **nbins** bins in **space**, and the nodes and
+    weights of a Gauss-Legendre quadrature with **npoints** points in each
+    bin, ordered by bin.
+    """
     bounds = space.limit1d
     bins_edges = np.linspace(*bounds, nbins+1)
-    data_asy = bins_edges[0: -1] + np.diff(bins_edges)/2
+    centres = bins_edges[0: -1] + np.diff(bins_edges)/2
+    halfwidth = np.diff(bins_edges)/2
+
+    x, w = np.polynomial.legendre.leggauss(npoints)
+    nodes = centres[:, np.newaxis] + halfwidth[:, np.newaxis] * x
+    weights = halfwidth[:, np.newaxis] * w
+
+    return centres, nodes.ravel(), weights.ravel()
+
+
+def adaptive_asymov_binning(edges, yields, flogf, f_edges, f_centres, tol,
+                            minbins=8):
+    """
+    Returns the centres and the yields of the bins of an adaptive binning,
+    made of unions of the fine bins of edges **edges** (2^k bins). Starting
+    from **minbins** bins, the bin where the Asimov negative log-likelihood,
+    yield times log f at the bin centre, differs the most from the integral
+    of f log f is split in two until the total difference is below **tol**.
+
+        **Arguments:**
+            - **edges** edges of the fine bins
+            - **yields** expected yields in the fine bins
+            - **flogf** integrals of f log f in the fine bins
+            - **f_edges** f at the edges of the fine bins
+            - **f_centres** f at the centres of the fine bins
+            - **tol** tolerance on the Asimov negative log-likelihood
+            - **minbins** minimal number of bins, rounded to a power of 2
+    """
+    nfine = len(yields)
+    cumyields = np.concatenate([[0.], np.cumsum(yields)])
+    cumflogf = np.concatenate([[0.], np.cumsum(flogf)])
+
+    def error(a, b):
+        # bin made of the fine bins a to b - 1
+        n = cumyields[b] - cumyields[a]
+        if b - a == 1:
+            fc = f_centres[a]
+        else:
+            fc = f_edges[(a + b) // 2]
+        nlogf = n * np.log(fc) if (n > 0 and fc > 0) else 0.
+        return abs(cumflogf[b] - cumflogf[a] - nlogf)
+
+    width = nfine
+    while width > 1 and nfine // width < minbins:
+        width //= 2
+
+    bins = []
+    total = 0.
+    for a in range(0, nfine, width):
+        e = error(a, a + width)
+        heapq.heappush(bins, (-e, a, a + width))
+        total += e
+
+    final = []
+    while total > tol and len(bins) > 0:
+        e, a, b = heapq.heappop(bins)
+        if b - a == 1:
+            final.append((a, b))
+            continue
+        m = (a + b) // 2
+        e1, e2 = error(a, m), error(m, b)
+        heapq.heappush(bins, (-e1, a, m))
+        heapq.heappush(bins, (-e2, m, b))
+        total += e1 + e2 + e
+
+    final += [(a, b) for _, a, b in bins]
+    final.sort()
+
+    centres = np.array([(edges[a] + edges[b]) / 2 for a, b in final])
+    yields = np.array([cumyields[b] - cumyields[a] for a, b in final])
+
+    return centres, yields
+
+
+def generate_asymov_dataset(model, params, space, nbins=100, npoints=1):
+
+    centres, nodes, weights = asymov_binning(space, nbins, npoints)
 
-    weight_asy = eval_pdf(model, data_asy, params)
-    weight_asy *= (space.area() / nbins)
+    yields = pdf_evaluator(model, nodes)(params) * weights
+    yields = yields.reshape(nbins, npoints).sum(axis=1)
 
-    return data_asy, weight_asy
+    return centres, yields
 
 
 # def Expected_Pvalues_2sided(pnull, palt):
@@ -1,28 +1,307 @@
 #!/usr/bin/python
 import numpy as np
+import shelve
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from ..parameters import POI
+from ..util import get_values, set_values, get_all_values, new_session
 # from numba import jit
 
 
+class FitCache(object):
+    """
+    Memoization of the minimum of a loss with a parameter fixed to a value,
+    to not minimize the same loss twice. Keeps count of the minimizations
+    done (**fits**) and saved (**hits**).
+    """
+
+    def __init__(self):
+        self._fmin = {}
+        self.hits = 0
+        self.fits = 0
+        self.ntoys = 0
+
+    @staticmethod
+    def _key(loss, param, value):
+        return (id(loss), param.name, float(value))
+
+    def get(self, loss, param, value):
+        """
+        Returns the minimum of **loss** with **param** fixed to **value**,
+        None if not computed.
+        """
+        key = self._key(loss, param, value)
+        if key in self._fmin:
+            self.hits += 1
+            return self._fmin[key]
+        else:
+            return None
+
+    def put(self, loss, param, value, fmin):
+        self._fmin[self._key(loss, param, value)] = fmin
+
+    def clear(self):
+        self._fmin = {}
+
+    def merge(self, other):
+        """
+        Add the counts of the FitCache **other**.
+        """
+        self.hits += other.hits
+        self.fits += other.fits
+        self.ntoys += other.ntoys
+
+    def newtoy(self):
+        """
+        Clear the cache for the next toy, whose data are different.
+        """
+        self.clear()
+        self.ntoys += 1
+
+    @property
+    def saved_per_toy(self):
+        """
+        Returns the average number of minimizations saved per toy.
+        """
+        return self.hits / self.ntoys if self.ntoys > 0 else 0.
+
+
+class LRUCache(object):
+    """
+    Cache of at most **maxsize** values, the least recently used value being
+    dropped first. If **filename** is given the values are also stored in a
+    shelve file, so they are kept when dropped and can be reused by other
+    sessions with the same configuration. The keys must be tuples of strings
+    and numbers.
+    """
+
+    def __init__(self, maxsize=1024, filename=None):
+        self.maxsize = maxsize
+        self._values = OrderedDict()
+        if filename is not None:
+            self._store = shelve.open(filename)
+        else:
+            self._store = None
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        if key in self._values:
+            return True
+        return self._store is not None and repr(key) in self._store
+
+    def __getitem__(self, key):
+        if key in self._values:
+            self._values.move_to_end(key)
+            return self._values[key]
+        if self._store is not None and repr(key) in self._store:
+            value = self._store[repr(key)]
+            self._insert(key, value)
+            return value
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        self._insert(key, value)
+        if self._store is not None:
+            self._store[repr(key)] = value
+
+    def _insert(self, key, value):
+        self._values[key] = value
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def close(self):
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+
+
+def fork_context():
+    """
+    Returns the multiprocessing context starting processes with fork, the
+    processes inherit the configuration whose models can not be pickled.
+    Raises a RuntimeError where fork is not available, e.g. on Windows.
+    """
+    if "fork" not in multiprocessing.get_all_start_methods():
+        msg = "Several processes need the 'fork' start method, which is not "
+        msg += "available on this platform."
+        raise RuntimeError(msg)
+    return multiprocessing.get_context("fork")
+
+
+def map_workers(initializer, initargs, function, tasks):
+    """
+    Calls **function** with the arguments of each of **tasks** in forked
+    processes, one per task, initialized by calling **initializer** with
+    **initargs**. Returns the results in the order of **tasks**.
+    """
+    context = fork_context()
+    with ProcessPoolExecutor(max_workers=len(tasks), mp_context=context,
+                             initializer=initializer,
+                             initargs=initargs) as executor:
+        futures = [executor.submit(function, *t) for t in tasks]
+        return [f.result() for f in futures]
+
+
+# state of a profile worker process, set by _init_obs_worker
+_obs_worker = {}
+
+
+def _init_obs_worker(config, poiparam, origin, values, state):
+    """
+    Initialize a profile worker process. The configuration is inherited from
+    the parent process (fork), the worker builds its own session, with the
+    parameters at their values **state** in the parent process, and its own
+    loss.
+    """
+    new_session(config.models, state)
+    _obs_worker["calculator"] = Calculator(config)
+    _obs_worker["loss"] = config.obsloss()
+    _obs_worker["poiparam"] = poiparam
+    _obs_worker["origin"] = origin
+    _obs_worker["values"] = values
+
+
+def _obs_nll_worker(poivalues):
+    calculator = _obs_worker["calculator"]
+    calculator.nfits = 0
+
+    poi = [POI(_obs_worker["poiparam"], v) for v in poivalues]
+    nll, _ = calculator.scan(_obs_worker["loss"], poi, _obs_worker["origin"],
+                             _obs_worker["values"])
+
+    return list(zip(poivalues.tolist(), nll.tolist())), calculator.nfits
+
+
 class Calculator(object):
 
-    def __init__(self, config):
+    def __init__(self, config, n_workers=1):
+        """
+        __init__ function
+
+        **Arguments:**
+            - **config** lauztat.config.Config object
+            - **n_workers** (optionnal) number of processes used to profile
+            the observed negative log-likelihood, the values of the parameter
+            of interest are split among them. Needs the fork start method,
+            not available on Windows.
+        """
         self.config = config
         self.minimizer = config.minimizer
         self.obsbestfit = config.bestfit
         self.pll = config.pll
         self._obs_nll = {}
+        self.nfits = 0
+        self.n_workers = n_workers
 
     def obs_nll(self, poi):
+        missing = [p for p in poi if p not in self._obs_nll.keys()]
+
+        if len(missing) > 0:
+            poiparam = missing[0].parameter
+            bestfit = self.config.bestfit
+            origin = bestfit.params[poiparam]["value"]
+            values = {p: bestfit.params[p]["value"]
+                      for p in self.config.nuisances(poiparam)}
+
+            if self.n_workers > 1 and len(missing) > 1:
+                nll = self._obs_nll_parallel(poiparam, missing, origin,
+                                             values)
+            else:
+                nll, _ = self.scan(self.config.obsloss(), missing, origin,
+                                   values)
+            for p, nll_ in zip(missing, nll):
+                self._obs_nll[p] = nll_
+
         ret = np.empty(len(poi))
         for i, p in enumerate(poi):
-            if p not in self._obs_nll.keys():
-                nll = self.pll(self.minimizer, self.config.obsloss(),
-                               p.parameter, p.value)
-                self._obs_nll[p] = nll
             ret[i] = self._obs_nll[p]
         return ret
 
+    def _obs_nll_parallel(self, poiparam, poi, origin, values):
+        """
+        Profile likelihood scan of the observed data for the parameters of
+        interest **poi**, split in **self.n_workers** processes. Each process
+        fits a contiguous range of values and returns (value, minimum) pairs.
+        """
+        poivalues = np.array([p.value for p in poi], dtype=float)
+        chunks = np.array_split(np.sort(poivalues), self.n_workers)
+        chunks = [c for c in chunks if len(c) > 0]
+
+        state = get_all_values(self.config.models)
+        initargs = (self.config, poiparam, origin, values, state)
+        results = map_workers(_init_obs_worker, initargs, _obs_nll_worker,
+                              [(c,) for c in chunks])
+
+        fmin = {}
+        for pairs, nfits in results:
+            fmin.update(pairs)
+            self.nfits += nfits
+
+        return np.array([fmin[v] for v in poivalues.tolist()])
+
+    def profile(self, loss, param, value, cache=None):
+        """
+        Returns the minimum of **loss** with **param** fixed to **value**,
+        from **cache** (a FitCache) if already computed. The fits done are
+        counted in **self.nfits**.
+        """
+        if cache is not None:
+            fmin = cache.get(loss, param, value)
+            if fmin is not None:
+                return fmin
+
+        fmin = self.pll(self.minimizer, loss, param, value)
+        self.nfits += 1
+
+        if cache is not None:
+            cache.put(loss, param, value, fmin)
+            cache.fits += 1
+
+        return fmin
+
+    def scan(self, loss, poi, origin, values, cache=None):
+        """
+        Profile likelihood scan of **loss** for the parameters of interest
+        **poi**. The points are visited by increasing distance to **origin**,
+        the best fit value of the parameter of interest, and each fit starts
+        from the nuisance parameters of the nearest point already fitted.
+
+        **Arguments:**
+            - **loss** the loss to minimize
+            - **poi** list of POI
+            - **origin** best fit value of the parameter of interest
+            - **values** dictionnary of the nuisance parameters values at the
+            best fit
+            - **cache** (optionnal) a FitCache, to not fit points already
+            fitted
+
+        Returns the minimum of the negative log-likelihood for each POI and
+        the list of (POI value, nuisance parameters values) fitted.
+        """
+        poi = list(poi)
+        ret = np.empty(len(poi))
+
+        solved = [(origin, values)]
+        distance = np.abs(np.array([p.value for p in poi]) - origin)
+
+        for i in np.argsort(distance, kind="stable"):
+            p = poi[i]
+            if cache is not None:
+                fmin = cache.get(loss, p.parameter, p.value)
+                if fmin is not None:
+                    ret[i] = fmin
+                    continue
+            _, start = min(solved, key=lambda s: abs(s[0] - p.value))
+            set_values(start)
+            ret[i] = self.profile(loss, p.parameter, p.value, cache)
+            solved.append((p.value, get_values(start.keys())))
+
+        return ret, solved
+
     def qobs(self, poinull, onesided=True, onesideddiscovery=False,
              qtilde=False):
         print("Compute qobs for the null hypothesis!")
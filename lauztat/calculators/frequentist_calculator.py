@@ -1,44 +1,471 @@
 # -*- coding: utf-8 -*-
 # !/usr/bin/python
-from .calculator import Calculator
+from .calculator import Calculator, FitCache, fork_context, map_workers
 from ..parameters import POI
+from ..util import eval_loss, get_values, set_values, set_seed
+from ..util import get_all_values, new_session
+from ..util import get_sample, load_sample
+from ..empirical import EmpiricalDistribution, StreamingDistribution
+from ..toys import ToyResult, ToyWriter, LazyToyResult
 import numpy as np
 from scipy.stats import norm
+import itertools
+import time
+from queue import Empty
+from contextlib import contextmanager
 np.warnings.filterwarnings('ignore')
 
 
+class SequentialStopping(object):
+    """
+    Stopping rule for the sequential generation of toys. The toys are
+    generated in batches of **batchsize** toys until the binomial uncertainty
+    on the p-value (CLs if **CLs** is True) is smaller than **rtol** times
+    the p-value, or the p-value is clearly above or below **alpha**, i.e. more
+    than **nsigma** uncertainties away.
+
+    **Example:**
+        stopping = SequentialStopping(alpha=0.05, CLs=True, rtol=0.05)
+        calc = FrequentistCalculator(config, ntoysnull=10000,
+                                     ntoysalt=10000, stopping=stopping)
+    """
+
+    def __init__(self, alpha=0.05, CLs=False, rtol=0.05, nsigma=3.,
+                 batchsize=100):
+        self.alpha = alpha
+        self.CLs = CLs
+        self.rtol = rtol
+        self.nsigma = nsigma
+        self.batchsize = batchsize
+
+    def stop(self, p, err):
+        """
+        Returns True if the p-value **p** with uncertainty **err** is precise
+        enough.
+        """
+        if p > 0 and err <= self.rtol * p:
+            return True
+        return abs(p - self.alpha) >= self.nsigma * err
+
+
+class FitRecovery(object):
+    """
+    Recovery of the toy fits that do not converge. Before a toy is discarded
+    and resampled, its fit is retried from other starting points, in the
+    order of **strategies**:
+
+        - "bestfit": the best fit values of the observed data
+        - "generated": the values used to generate the toy
+        - "previous": the solution of the previous toy
+
+    The outcomes of the toy fits are counted in **converged** (at the first
+    fit), **recovered** and **discarded**. If **maxdiscard** samples of a
+    same toy are discarded a RuntimeError is raised.
+
+    **Example:**
+        recovery = FitRecovery(strategies=["generated", "bestfit"])
+        calc = FrequentistCalculator(config, recovery=recovery)
+    """
+
+    STRATEGIES = ("bestfit", "generated", "previous")
+
+    def __init__(self, strategies=STRATEGIES, maxdiscard=100):
+        unknown = [s for s in strategies if s not in self.STRATEGIES]
+        if len(unknown) > 0:
+            msg = "Unknown recovery strategies {0}, available are {1}."
+            raise ValueError(msg.format(unknown, self.STRATEGIES))
+        self.strategies = list(strategies)
+        self.maxdiscard = maxdiscard
+        self.reset()
+
+    def reset(self):
+        self.converged = 0
+        self.recovered = 0
+        self.discarded = 0
+
+    def merge(self, other):
+        """
+        Add the counts of the FitRecovery **other**.
+        """
+        self.converged += other.converged
+        self.recovered += other.recovered
+        self.discarded += other.discarded
+
+    @property
+    def nfits(self):
+        """
+        Returns the number of toy fits done, discarded ones included.
+        """
+        return self.converged + self.recovered + self.discarded
+
+    def summary(self):
+        """
+        Returns a dictionnary with the counts and the fractions of the toy
+        fits converged at the first fit, recovered and discarded.
+        """
+        ret = {"converged": self.converged, "recovered": self.recovered,
+               "discarded": self.discarded}
+        n = self.nfits
+        for k in list(ret.keys()):
+            ret[k + "_rate"] = ret[k] / n if n > 0 else 0.
+        return ret
+
+
+class ToyStats(object):
+    """
+    Statistics of the generation of the toys: time spent in each phase of
+    a toy ("sample", "bestfit", "scan" and "weights"), throughput, number of
+    minimizations per toy from the FitCache **cache** and outcomes of the
+    fits from the FitRecovery **recovery**.
+
+    **Example:**
+        calc = FrequentistCalculator(config, callback=monitor)
+        calc.dotoys(poigen, 1000, poieval)
+        print(calc.stats.summary())
+    """
+
+    PHASES = ("sample", "bestfit", "scan", "weights")
+
+    def __init__(self, cache=None, recovery=None):
+        if cache is None:
+            cache = FitCache()
+        if recovery is None:
+            recovery = FitRecovery()
+        self.cache = cache
+        self.recovery = recovery
+        self.time = {}
+        self.reset()
+
+    def reset(self):
+        self.time = {p: 0. for p in self.PHASES}
+        self.walltime = 0.
+        self.ntoys = 0
+        self.cache.clear()
+        self.cache.hits = 0
+        self.cache.fits = 0
+        self.cache.ntoys = 0
+        self.recovery.reset()
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Context manager adding the time spent in its block to **phase**.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.time[phase] += time.perf_counter() - start
+
+    def merge(self, other):
+        """
+        Add the statistics of the ToyStats **other**, e.g. of a worker
+        process. The wall time is not added.
+        """
+        for p in self.PHASES:
+            self.time[p] += other.time[p]
+        self.ntoys += other.ntoys
+        self.cache.merge(other.cache)
+        self.recovery.merge(other.recovery)
+
+    @property
+    def toys_per_second(self):
+        return self.ntoys / self.walltime if self.walltime > 0 else 0.
+
+    @property
+    def fits_per_toy(self):
+        """
+        Returns the average number of minimizations per toy, the fits of
+        the discarded samples included.
+        """
+        return self.cache.fits / self.ntoys if self.ntoys > 0 else 0.
+
+    def summary(self):
+        """
+        Returns a dictionnary with the statistics.
+        """
+        ret = {"ntoys": self.ntoys, "walltime": self.walltime,
+               "toys_per_second": self.toys_per_second,
+               "fits": self.cache.fits, "fits_per_toy": self.fits_per_toy,
+               "saved_per_toy": self.cache.saved_per_toy}
+        for p in self.PHASES:
+            ret["time_" + p] = self.time[p]
+        ret.update(self.recovery.summary())
+        return ret
+
+
+def _produce_toys(queue, config, param, value, start, ntoys, values,
+                  genvalues):
+    """
+    Sample the toys in a forked process and put their data in **queue**.
+    With a seed the toys numbered from **start** to **start** + **ntoys**
+    are sampled, otherwise toys are sampled until the process is stopped.
+    """
+    try:
+        # the session of the parent process can not be used after fork, the
+        # process builds its own session, with the parameters at their
+        # **values** in the parent process, and its own sampler at the
+        # values **genvalues** of the nuisance parameters of the sampler of
+        # the parent process
+        new_session(config.models, values)
+        if config.seed is not None:
+            indices = range(start, start + ntoys)
+        else:
+            # the random state is a copy of the one of the parent process
+            state = np.random.SeedSequence().generate_state(1)[0]
+            set_seed(config.models[0], int(state))
+            indices = itertools.count(start)
+        set_values(genvalues)
+        sampler = config.sampler(floatting_params=[param])
+
+        for i in indices:
+            toys = config.sample(sampler, 1, param, value, start=i)
+            next(toys)
+            queue.put((i, [get_sample(s) for s in sampler]))
+    except Exception as error:
+        msg = "Sampling of the toys failed: {0!r}"
+        queue.put(RuntimeError(msg.format(error)))
+
+
+class _ToyProducer(object):
+    """
+    Samples the toys ahead of their fit in a forked process, with at most
+    **maxsize** toys waiting in a queue. Sampling sets the values of the
+    parameters, so it can not run in a thread next to the fits. A toy not
+    sampled after **timeout** seconds raises a RuntimeError.
+    """
+
+    def __init__(self, config, param, value, start, ntoys, maxsize,
+                 genvalues, timeout=600.):
+        context = fork_context()
+        self.queue = context.Queue(maxsize)
+        self.timeout = timeout
+        values = get_all_values(config.models)
+        args = (self.queue, config, param, value, start, ntoys, values,
+                genvalues)
+        self.process = context.Process(target=_produce_toys, args=args)
+        self.process.daemon = True
+        self.process.start()
+
+    def load(self, sampler):
+        """
+        Load the data of the next toy in **sampler**, returns its index.
+        """
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            try:
+                item = self.queue.get(timeout=1.)
+                break
+            except Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError("The toy producer process died.")
+                if time.perf_counter() > deadline:
+                    self.close()
+                    msg = "No toy sampled by the toy producer process in "
+                    msg += "{0} seconds."
+                    raise RuntimeError(msg.format(self.timeout))
+
+        if isinstance(item, Exception):
+            raise item
+
+        i, samples = item
+        for s, sample in zip(sampler, samples):
+            load_sample(s, sample)
+        return i
+
+    def close(self):
+        self.process.terminate()
+        self.process.join()
+
+
+# state of a toy worker process, set by _init_worker
+_worker = {}
+
+
+def _init_worker(config, poigen, poieval, poiweight, recovery, values,
+                 genvalues):
+    """
+    Initialize a toy worker process. The configuration is inherited from the
+    parent process (fork), the worker builds its own session, with the
+    parameters at their **values** in the parent process, and its own
+    sampler, at the values **genvalues** of the nuisance parameters of the
+    sampler of the parent process.
+    """
+    new_session(config.models, values)
+    set_values(genvalues)
+    recovery = FitRecovery(recovery.strategies, recovery.maxdiscard)
+    _worker["calculator"] = FrequentistCalculator(config, recovery=recovery)
+    _worker["poigen"] = poigen
+    _worker["poieval"] = poieval
+    _worker["poiweight"] = poiweight
+
+
+def _dotoys_worker(ntoys, start, printfreq, seed):
+    calculator = _worker["calculator"]
+    poieval = _worker["poieval"]
+    poiweight = _worker["poiweight"]
+
+    # the forked workers inherit the random state of the parent process,
+    # each one is seeded with its own seed before it builds its sampler
+    set_seed(calculator.config.models[0], seed)
+
+    stats = calculator.stats
+    stats.reset()
+
+    result = calculator.dotoys(_worker["poigen"], ntoys, poieval,
+                               printfreq=printfreq, n_workers=1, start=start,
+                               poiweight=poiweight)
+
+    stats.cache.clear()
+    return result, stats
+
+
 class FrequentistCalculator(Calculator):
     """
     Class for for frequentist calculators.
     """
 
-    def __init__(self, config, ntoysnull=1000, ntoysalt=1000):
+    def __init__(self, config, ntoysnull=1000, ntoysalt=1000, n_workers=1,
+                 stopping=None, importance_shift=None, checkpoint=None,
+                 checkpoint_every=100, anchors=None, recovery=None,
+                 callback=None, streaming=False, pipeline=0):
         """
         __init__ function
+
+        **Arguments:**
+            - **config** a lauztat.config.Config
+            - **ntoysnull** number of toys for the null hypothesis
+            - **ntoysalt** number of toys for the alternative hypothesis
+            - **n_workers** number of processes used to generate and fit the
+            toys, and to profile the observed negative log-likelihood.
+            - **stopping** a SequentialStopping rule, if given the toys are
+            generated in batches until the p-values are precise enough, with
+            at most **ntoysnull** and **ntoysalt** toys.
+            - **importance_shift** if given the toys of the null hypothesis
+            are generated with the parameter of interest shifted by this
+            value and reweighted by their likelihood ratio to the null
+            hypothesis, to estimate small p-values with few toys.
+            - **checkpoint** name of an hdf5 file where the toys are saved
+            every **checkpoint_every** toys while they are generated. Toys
+            already stored in the file are not generated again.
+            - **anchors** values of the parameter of interest where the toys
+            of the null hypothesis are generated. The toys of a value of the
+            parameter of interest are the toys of its nearest anchor,
+            reweighted by their likelihood ratio. Can not be used with a
+            **stopping** rule.
+            - **recovery** a FitRecovery, how the toy fits that do not
+            converge are retried before the toy is discarded. By default all
+            the strategies are tried.
+            - **callback** function called with the ToyStats of the
+            calculator, instead of printing the progress of the toys.
+            - **streaming** if True, or a dictionnary with the "batchsize"
+            (default 1000) and the StreamingDistribution arguments, the toys
+            are generated in batches and only summaries of the distributions
+            of the test statistic are kept, with exact p-values at the
+            observed values. The memory does not grow with the number of
+            toys. Can not be used with a **stopping** rule, **anchors** or a
+            **checkpoint**.
+            - **pipeline** number of toys sampled ahead in a separate process
+            while the current toy is fitted, 0 to sample and fit in turn.
+            Only used with one worker. Needs the fork start method, not
+            available on Windows.
         """
 
-        super(FrequentistCalculator, self).__init__(config)
+        super(FrequentistCalculator, self).__init__(config, n_workers)
 
         self.toysresults = {}
         self._minimizers = {}
         self.ntoysnull = ntoysnull
         self.ntoysalt = ntoysalt
+        self.stopping = stopping
+        self.importance_shift = importance_shift
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+
+        if anchors is not None and stopping is not None:
+            msg = "Toys can not be generated at anchors with a stopping rule."
+            raise ValueError(msg)
+        self.anchors = anchors
+
+        # the arguments of the StreamingDistribution, an empty dictionnary
+        # still turns the streaming on
+        self.streaming = streaming is not False and streaming is not None
+        if self.streaming and not (stopping is None and anchors is None and
+                                   checkpoint is None):
+            msg = "Toys can not be streamed with a stopping rule, anchors or "
+            msg += "a checkpoint."
+            raise ValueError(msg)
+        if streaming is True:
+            streaming = {}
+        if self.streaming:
+            streaming = dict(streaming)
+            self.batchsize = streaming.pop("batchsize", 1000)
+            self._streaming = streaming
+        self.qsummaries = {}
+        self.pipeline = pipeline
 
         self.sampler = {}
         self.loss_toys = {}
+        self._genvalues = {}
+        self.fitcache = FitCache()
+
+        if recovery is None:
+            recovery = FitRecovery()
+        self.recovery = recovery
+
+        self.stats = ToyStats(self.fitcache, recovery)
+        self.callback = callback
+
+    def dotoys(self, poigen, ntoys, poieval, printfreq=0.2, n_workers=None,
+               start=0, poiweight=None, checkpoint=None):
+        """
+        Generate toys for the parameter of interest **poigen** and scan their
+        negative log-likelihood for the parameters of interest **poieval**.
+
+        **Arguments:**
+            - **poigen** POI used to generate the toys
+            - **ntoys** number of toys
+            - **poieval** list of POI to evaluate the negative log-likelihood
+            - **printfreq** printing frequency, as a fraction of **ntoys**
+            - **n_workers** number of processes, if None **self.n_workers** is
+            used. With more than one worker the toys are split between forked
+            processes, each seeded with its own seed and building its own
+            session, sampler and loss from the config. The samplers are built
+            at the values of the nuisance parameters of the sampler of the
+            calculator. Needs the fork start method, not available on
+            Windows.
+            - **start** index of the first toy, used to derive the random
+            streams of the toys if the config has a seed.
+            - **poiweight** list of POI for which the toys are reweighted,
+            the weight of a toy being its likelihood ratio between the POI
+            and **poigen**, with the nuisance parameters at their generated
+            values.
+            - **checkpoint** name of an hdf5 file to save the toys while they
+            are generated, if None **self.checkpoint** is used. The toys
+            already stored in the file for **poigen** are not generated
+            again.
+        """
+        if n_workers is None:
+            n_workers = self.n_workers
+        if checkpoint is None:
+            checkpoint = self.checkpoint
+
+        if checkpoint:
+            return self._dotoys_checkpoint(poigen, ntoys, poieval, printfreq,
+                                           n_workers, start, poiweight,
+                                           checkpoint)
+
+        if n_workers > 1 and ntoys > 1:
+            return self._dotoys_parallel(poigen, ntoys, poieval, printfreq,
+                                         n_workers, start, poiweight)
 
-    def dotoys(self, poigen, ntoys, poieval, printfreq=0.2):
         config = self.config
         models = config.models
         minimizer = config.minimizer
         g_param = poigen.parameter
         g_value = poigen.value
 
-        try:
-            sampler = self.sampler[g_param]
-        except KeyError:
-            sampler = self.config.sampler(floatting_params=[g_param])
-            self.sampler[g_param] = sampler
+        sampler = self._toy_sampler(g_param)
 
         try:
             loss_toys = self.loss_toys[g_param]
@@ -46,119 +473,417 @@ class FrequentistCalculator(Calculator):
             loss_toys = self.config.lossbuilder(models, sampler)
             self.loss_toys[g_param] = loss_toys
 
-        result = {"bestfit": {"values": np.empty(ntoys),
-                              "nll": np.empty(ntoys)}}
-        result["nll"] = {}
-        for p in poieval:
-            result["nll"][p] = np.empty(ntoys)
+        nuisances = config.nuisances(g_param)
+        cache = self.fitcache
+        recovery = self.recovery
+        stats = self.stats
+        tick = time.perf_counter()
+
+        genvalues = dict(self._genvalues[g_param])
+        genvalues[g_param] = g_value
+        previous = None
+
+        if poiweight is not None:
+            weighted = [p.value for p in poiweight]
+            weights = np.empty(len(poiweight))
+        else:
+            weighted = None
+            weights = None
+
+        result = ToyResult(g_value, [p.value for p in poieval], ntoys,
+                           weighted)
+        result.index = np.arange(start, start + ntoys)
 
         printfreq = ntoys * printfreq
 
-        toys = self.config.sample(sampler, int(ntoys*1.2), g_param, g_value)
-
-        for i in range(ntoys):
-            converged = False
-            toprint = i % printfreq == 0
-            while converged is False:
-                try:
-                    next(toys)
-                except StopIteration:
-                    to_gen = ntoys - i
-                    toys = self.config.sample(sampler, int(to_gen*1.2),
-                                              g_param, g_value)
-                    next(toys)
-
-                bf = minimizer.minimize(loss=loss_toys)
-                converged = bf.converged
-
-                if not converged:
-                    config.deps_tobestfit()
-                    continue
+        # with a seed every toy is sampled from its own random stream, and
+        # fitted from the observed best fit values, so the toy number i is
+        # the same whatever the number of processes or jobs.
+        seeded = config.seed is not None
+
+        # with a pipeline the toys are sampled in a forked process, and
+        # with a seed only the toys resampled after a fit that did not
+        # converge are sampled here
+        producer = None
+        if self.pipeline > 0:
+            producer = _ToyProducer(config, g_param, g_value, start, ntoys,
+                                    self.pipeline, self._genvalues[g_param])
+        elif not seeded:
+            toys = self.config.sample(sampler, int(ntoys*1.2), g_param,
+                                      g_value)
+
+        try:
+            for i in range(ntoys):
+                converged = False
+                attempt = 0
+                discarded = 0
+                toprint = i % printfreq == 0
+                while converged is False:
+                    with stats.timer("sample"):
+                        if producer is not None and (attempt == 0 or
+                                                     not seeded):
+                            producer.load(sampler)
+                        elif seeded:
+                            toys = self.config.sample(sampler, 1, g_param,
+                                                      g_value, start=start + i,
+                                                      attempt=attempt)
+                            next(toys)
+                        else:
+                            try:
+                                next(toys)
+                            except StopIteration:
+                                to_gen = ntoys - i
+                                toys = self.config.sample(sampler,
+                                                          int(to_gen*1.2),
+                                                          g_param, g_value)
+                                next(toys)
+
+                        if seeded:
+                            attempt += 1
+                            config.deps_tobestfit()
+
+                    with stats.timer("bestfit"):
+                        minimum = minimizer.minimize(loss=loss_toys)
+                        cache.fits += 1
+
+                        if minimum.converged:
+                            recovery.converged += 1
+                        elif seeded:
+                            # the fit started from the best fit, and the
+                            # previous toy depends on the toys generated
+                            # before
+                            minimum = self._recover(loss_toys, genvalues,
+                                                    bestfit=False)
+                        else:
+                            minimum = self._recover(loss_toys, genvalues,
+                                                    previous)
+
+                    if minimum is None:
+                        discarded += 1
+                        if discarded >= recovery.maxdiscard:
+                            msg = "The fits of {0} samples of the toy {1} "
+                            msg += "generated for {2} did not converge."
+                            raise RuntimeError(msg.format(discarded, start + i,
+                                                          poigen))
+                        config.deps_tobestfit()
+                        continue
+
+                    converged = True
+                    cache.newtoy()
+
+                    with stats.timer("scan"):
+                        # the profile likelihood at the best fit is the
+                        # minimum
+                        bf = minimum.params[g_param]["value"]
+                        cache.put(loss_toys, g_param, bf, minimum.fmin)
+                        nllbf = self.profile(loss_toys, g_param, bf, cache)
+
+                        values = {p: minimum.params[p]["value"]
+                                  for p in nuisances}
+                        previous = dict(values)
+                        previous[g_param] = bf
+                        nll, _ = self.scan(loss_toys, poieval, bf, values,
+                                           cache)
+
+                    if poiweight is not None:
+                        with stats.timer("weights"):
+                            nllgen = eval_loss(loss_toys, genvalues)
+                            for j, p in enumerate(poiweight):
+                                values = dict(genvalues)
+                                values[p.parameter] = p.value
+                                nllw = eval_loss(loss_toys, values)
+                                weights[j] = np.exp(nllgen - nllw)
+
+                    result.fill(i, bf, nllbf, nll, weights)
+
+                stats.ntoys += 1
+                now = time.perf_counter()
+                stats.walltime += now - tick
+                tick = now
+
+                if toprint:
+                    self._progress(i)
+
+                if i > ntoys:
+                    break
+                i += 1
+        finally:
+            if producer is not None:
+                producer.close()
+
+        return result
 
-                bf = bf.params[g_param]["value"]
-                result["bestfit"]["values"][i] = bf
-                nll = config.pll(minimizer, loss_toys, g_param, bf)
-                result["bestfit"]["nll"][i] = nll
+    def _toy_sampler(self, param):
+        """
+        Returns the sampler of the toys generated for the parameter of
+        interest **param**, built once. The values of the nuisance
+        parameters frozen in the sampler are kept in **self._genvalues**.
+        With a seed they are the best fit values, so that a toy does not
+        depend on the fits done before the sampler is built, e.g. by another
+        calculator, process or job.
+        """
+        if param not in self.sampler.keys():
+            if self.config.seed is not None:
+                self.config.deps_tobestfit()
+            sampler = self.config.sampler(floatting_params=[param])
+            self.sampler[param] = sampler
+            self._genvalues[param] = get_values(self.config.nuisances(param))
+        return self.sampler[param]
+
+    def _recover(self, loss, genvalues, previous=None, bestfit=True):
+        """
+        Retry the fit of a toy that did not converge from the starting
+        points of **self.recovery**, the best fit values are not used if
+        **bestfit** is False. Returns the first converged minimum, None if
+        none converged.
+        """
+        minimizer = self.config.minimizer
 
-                for p in poieval:
-                    param_ = p.parameter
-                    val_ = p.value
-                    nll = config.pll(minimizer, loss_toys, param_, val_)
-                    result["nll"][p][i] = nll
+        for strategy in self.recovery.strategies:
+            if strategy == "bestfit":
+                if not bestfit:
+                    continue
+                self.config.deps_tobestfit()
+            elif strategy == "generated":
+                set_values(genvalues)
+            elif strategy == "previous":
+                if previous is None:
+                    continue
+                set_values(previous)
 
-            if toprint:
-                print("{0} toys generated, fitted and scanned!".format(i))
+            minimum = minimizer.minimize(loss=loss)
+            self.fitcache.fits += 1
+            if minimum.converged:
+                self.recovery.recovered += 1
+                return minimum
 
-            if i > ntoys:
-                break
-            i += 1
+        self.recovery.discarded += 1
+        return None
+
+    def _progress(self, i):
+        """
+        Report the progress of the toys to **self.callback**, printed if
+        there is no callback.
+        """
+        if self.callback is not None:
+            self.callback(self.stats)
+            return
+
+        summary = self.stats.summary()
+        print("{0} toys generated, fitted and scanned!".format(i))
+        msg = "{toys_per_second:.2f} toys per second, sampling "
+        msg += "{time_sample:.1f} s, best fit {time_bestfit:.1f} s, scan "
+        msg += "{time_scan:.1f} s."
+        print(msg.format(**summary))
+        msg = "{fits_per_toy:.2f} minimizations per toy, {saved_per_toy:.2f} "
+        msg += "saved."
+        print(msg.format(**summary))
+        msg = "{converged} fits converged, {recovered} recovered and "
+        msg += "{discarded} discarded."
+        print(msg.format(**summary))
+
+    def _dotoys_checkpoint(self, poigen, ntoys, poieval, printfreq, n_workers,
+                           start, poiweight, checkpoint):
+
+        with ToyWriter(checkpoint, seed=self.config.seed) as writer:
+            index = np.arange(start, start + ntoys)
+            missing = index[~np.isin(index, writer.index(poigen.value))]
+            done = ntoys - len(missing)
+            if done > 0:
+                msg = "{0} toys for {1} read from '{2}'."
+                print(msg.format(done, poigen, checkpoint))
+
+            # the missing toys are generated by runs of consecutive indices
+            runs = np.split(missing, np.where(np.diff(missing) != 1)[0] + 1)
+            for run in runs:
+                for first in range(0, len(run), self.checkpoint_every):
+                    n = min(self.checkpoint_every, len(run) - first)
+                    toys = self.dotoys(poigen, n, poieval, printfreq,
+                                       n_workers, int(run[first]), poiweight,
+                                       checkpoint=False)
+                    writer.append(toys)
+
+            result = writer.read(poigen.value, index=index)
+
+        missing = [p for p in poieval if not result.has(p.value)]
+        if len(missing) > 0:
+            msg = "Toys stored in '{0}' are not evaluated for {1}."
+            raise ValueError(msg.format(checkpoint, missing))
 
         return result
 
-    def add_toys(self, poi, toys):
-        bf = toys["bestfit"]["values"]
-        nllbf = toys["bestfit"]["nll"]
+    def _dotoys_parallel(self, poigen, ntoys, poieval, printfreq, n_workers,
+                         start=0, poiweight=None):
+        tick = time.perf_counter()
+        chunks = np.array_split(np.arange(start, start + ntoys), n_workers)
+        chunks = [c for c in chunks if len(c) > 0]
+
+        # the workers generate the toys at the values of the nuisance
+        # parameters of the sampler of this calculator
+        self._toy_sampler(poigen.parameter)
+        genvalues = self._genvalues[poigen.parameter]
+        values = get_all_values(self.config.models)
+
+        # the seeds of the workers are drawn from the seed of the config, or
+        # from the numpy random state, e.g. set by zfit.settings.set_seed
+        if self.config.seed is not None:
+            entropy = [self.config.seed, start]
+        else:
+            entropy = np.random.randint(2**31)
+        seeds = np.random.SeedSequence(entropy).generate_state(len(chunks))
+
+        initargs = (self.config, poigen, poieval, poiweight, self.recovery,
+                    values, genvalues)
+        tasks = [(len(c), int(c[0]), printfreq, int(seed))
+                 for c, seed in zip(chunks, seeds)]
+
+        results = map_workers(_init_worker, initargs, _dotoys_worker, tasks)
 
-        nlldict = {}
-        for k, v in toys["nll"]:
-            poi_ = POI(poi.name, k)
-            nlldict[poi_] = v
+        for _, stats in results:
+            self.stats.merge(stats)
+        self.stats.walltime += time.perf_counter() - tick
 
-        toyresult = {"bestfit": {"values": bf, "nll": nllbf}, "nll": nlldict}
-        self.toysresults[poi] = toyresult
+        return ToyResult.concatenate([r for r, _ in results])
+
+    def add_toys(self, poi, toys):
+        """
+        Add the toys generated for **poi**, a ToyResult or a dictionnary in
+        the layout of the hdf5 files.
+        """
+        if not isinstance(toys, ToyResult):
+            toys = ToyResult.from_dict(poi.value, toys)
+        self.toysresults[poi] = toys
 
     def toys_to_hdf5(self, filename):
         import h5py
 
         f = h5py.File(filename, "w")
 
+        if self.config.seed is not None:
+            f.attrs["seed"] = self.config.seed
+
         for k, v in self.toysresults.items():
             # k = POI("name", poivalue)
             poigenv = str(k.value)
             f.create_group(poigenv)
-            for j, l in v.items():
-                # j in ['bestfit', 'nll']
+            for j, l in v.to_dict().items():
+                # j in ['bestfit', 'nll', 'weights']
                 f[poigenv].create_group(j)
                 for o, p in l.items():
                     # if j = 'bestfit' , o in ['values', 'nll']
-                    # if j = 'nll', o = poival
+                    # if j in ['nll', 'weights'], o = poival
                     if not isinstance(o, str):
-                        o = str(o.value)
+                        o = str(o)
                     f[poigenv][j].create_dataset(o, data=p)
 
         print("Toys successfully saved to '{0}' !".format(filename))
 
-    def readtoys_from_hdf5(self, parameter, filename):
+    def readtoys_from_hdf5(self, parameter, filename, lazy=False):
+        """
+        Read toys saved with **toys_to_hdf5**.
+
+        **Arguments:**
+            - **parameter** the parameter of interest of the toys
+            - **filename** name of the hdf5 file
+            - **lazy** if True the file is kept open and the toys are only
+            read, or memory mapped, when they are used.
+        """
         import h5py
 
         toys = {}
         f = h5py.File(filename, "r")
 
+        if lazy:
+            for k, v in f.items():
+                toys[POI(parameter, float(k))] = LazyToyResult(v, float(k))
+            self.toysresults = toys
+            print("Toys successfully opened from '{0}' !".format(filename))
+            return
+
         for k, v in f.items():
             # k = poigen
             if isinstance(k, str):
                 k = float(k)
             k_ = {}
-            toys[POI(parameter, float(k))] = k_
             for j, l in v.items():
-                # j in ['bestfit', 'nll']
+                # j in ['bestfit', 'nll', 'weights']
                 j_ = {}
                 k_[j] = j_
                 for o, p in l.items():
-                    if isinstance(o, str) and j == "nll":
-                        o = POI(parameter, float(o))
+                    if isinstance(o, str) and j in ["nll", "weights"]:
+                        o = float(o)
                     j_[o] = np.asarray(p)
                     # if j = 'bestfit' , o in ['values', 'nll']
-                    # if j = 'nll', o = poival
+                    # if j in ['nll', 'weights'], o = poival
+            toys[POI(parameter, k)] = ToyResult.from_dict(k, k_)
 
         f.close()
         self.toysresults = toys
         print("Toys successfully read from '{0}' !".format(filename))
 
+    def toeval(self, p, pois, qtilde=False):
+        """
+        Returns the list of POI at which the toys generated for **p** are
+        evaluated: **p**, **pois** and 0 with **qtilde**.
+        """
+        toeval = [p]
+        if pois is not None:
+            for p_ in pois:
+                toeval.append(p_)
+        if qtilde:
+            poi0 = POI(p.parameter, 0.)
+            if poi0 not in toeval:
+                toeval.append(poi0)
+        return toeval
+
+    def _dotoys_hypo(self, poi, ntoys, poieval, start=0, null=False):
+        """
+        Generate the toys of the hypothesis **poi**. For the null hypothesis
+        with importance sampling the toys are generated at the shifted value
+        of the parameter of interest and reweighted to **poi**.
+        """
+        if null and self.importance_shift is not None:
+            poigen = POI(poi.parameter, poi.value + self.importance_shift)
+            return self.dotoys(poigen, ntoys, poieval, start=start,
+                               poiweight=[poi])
+        else:
+            return self.dotoys(poi, ntoys, poieval, start=start)
+
+    def extend_toys(self, poigen, ntoys, poieval, null=False):
+        """
+        Generate **ntoys** more toys for **poigen**, evaluated at the POI
+        **poieval**, and append them to the toys already generated. The toys
+        of the null hypothesis (**null**) are generated with importance
+        sampling if the calculator has an **importance_shift**.
+        """
+        if poigen not in self.toysresults.keys():
+            toys = self._dotoys_hypo(poigen, ntoys, poieval, null=null)
+            self.toysresults[poigen] = toys
+            return
+
+        toys = self.toysresults[poigen]
+        if isinstance(toys, LazyToyResult):
+            toys = toys.load()
+            self.toysresults[poigen] = toys
+        new = self._dotoys_hypo(poigen, ntoys, poieval, len(toys), null)
+        toys.append(new)
+
+    def ntoys(self, poigen):
+        """
+        Returns the number of toys generated for **poigen**.
+        """
+        if poigen not in self.toysresults.keys():
+            return 0
+        return len(self.toysresults[poigen])
+
     def dotoys_null(self, poinull, poialt=None, qtilde=False, printlevel=1):
 
         ntoys = self.ntoysnull
 
+        if self.anchors is not None:
+            self._dotoys_anchors(poinull, poialt, qtilde, printlevel)
+            return
+
         for p in poinull:
             if p in self.toysresults.keys():
                 continue
@@ -166,19 +891,47 @@ class FrequentistCalculator(Calculator):
             if printlevel >= 0:
                 print(msg.format(p))
 
-            toeval = [p]
-            if poialt is not None:
-                for palt in poialt:
-                    toeval.append(palt)
-            if qtilde:
-                poi0 = POI(poinull.parameter, 0.)
-                if poi0 not in toeval:
-                    toeval.append(poi0)
-
-            toyresult = self.dotoys(p, ntoys, toeval)
+            toeval = self.toeval(p, poialt, qtilde)
+            toyresult = self._dotoys_hypo(p, ntoys, toeval, null=True)
 
             self.toysresults[p] = toyresult
 
+    def _dotoys_anchors(self, poinull, poialt=None, qtilde=False,
+                        printlevel=1):
+        """
+        Generate the toys of the null hypothesis at the anchors and reweight
+        them to the values of **poinull**.
+        """
+        anchors = np.asarray(self.anchors, dtype=float)
+
+        targets = {}
+        for p in poinull:
+            if p in self.toysresults.keys():
+                continue
+            a = anchors[np.argmin(np.abs(anchors - p.value))]
+            targets.setdefault(a, []).append(p)
+
+        for a, pois in targets.items():
+            poigen = POI(poinull.parameter, a)
+            msg = "Generating null hypothesis toys for {0}, reweighted to {1}."
+            if printlevel >= 0:
+                print(msg.format(poigen, [p.value for p in pois]))
+
+            toeval = []
+            for p in pois:
+                for p_ in self.toeval(p, poialt, qtilde):
+                    if p_ not in toeval:
+                        toeval.append(p_)
+
+            toyresult = self.dotoys(poigen, self.ntoysnull, toeval,
+                                    poiweight=pois)
+
+            for p in pois:
+                self.toysresults[p] = toyresult
+                if printlevel >= 0:
+                    msg = "Effective number of toys for {0}: {1:.1f}."
+                    print(msg.format(p, toyresult.ess(p.value)))
+
     def dotoys_alt(self, poialt, poinull=None, qtilde=False, printlevel=1):
 
         ntoys = self.ntoysalt
@@ -191,35 +944,181 @@ class FrequentistCalculator(Calculator):
             if printlevel >= 0:
                 print(msg.format(p))
 
-            toeval = [p]
-            if poinull is not None:
-                for p_ in poinull:
-                    toeval.append(p_)
-            if qtilde:
-                poi0 = POI(poinull.parameter, 0.)
-                if poi0 not in toeval:
-                    toeval.append(poi0)
-
+            toeval = self.toeval(p, poinull, qtilde)
             toyresult = self.dotoys(p, ntoys, toeval)
 
             self.toysresults[p] = toyresult
 
+    def dotoys_sequential(self, qobs, poinull, poialt=None, qtilde=False,
+                          onesided=True, onesideddiscovery=False,
+                          printlevel=1):
+        """
+        Generate the toys for the null and alternative hypothesis in batches
+        until the p-values are precise enough according to **self.stopping**,
+        or **ntoysnull**/**ntoysalt** toys are generated.
+        """
+        rule = self.stopping
+        batchsize = rule.batchsize
+        needpalt = poialt is not None
+
+        done = np.zeros(len(poinull), dtype=bool)
+
+        while True:
+            for i, p in enumerate(poinull):
+                n = min(batchsize, self.ntoysnull - self.ntoys(p))
+                if done[i] or n <= 0:
+                    continue
+                toeval = self.toeval(p, poialt, qtilde)
+                self.extend_toys(p, n, toeval, null=True)
+
+            if needpalt:
+                n = min(batchsize, self.ntoysalt - self.ntoys(poialt))
+                if not all(done) and n > 0:
+                    toeval = self.toeval(poialt, poinull, qtilde)
+                    self.extend_toys(poialt, n, toeval)
+
+            pvalues = self._pvalue_q(qobs, poinull, poialt, qtilde, onesided,
+                                     onesideddiscovery)
+            pnull, palt, errors = pvalues
+
+            if needpalt and rule.CLs:
+                p_, err = self._cls(pnull, palt, errors)
+            else:
+                p_, err = pnull, errors["pnull"]
+
+            for i, p in enumerate(poinull):
+                full = self.ntoys(p) >= self.ntoysnull
+                if needpalt:
+                    full = full and self.ntoys(poialt) >= self.ntoysalt
+                done[i] = full or rule.stop(p_[i], err[i])
+
+            if printlevel > 0:
+                msg = "{0} of {1} p-values precise enough."
+                print(msg.format(np.sum(done), len(done)))
+
+            if all(done):
+                break
+
+    def dotoys_streaming(self, qobs, poinull, poialt=None, qtilde=False,
+                         onesided=True, onesideddiscovery=False,
+                         printlevel=1):
+        """
+        Generate the toys for the null and alternative hypothesis in batches
+        of **self.batchsize** toys, and fill the StreamingDistribution of the
+        test statistic, exact at the observed values **qobs** (optionnal).
+        The toys are not kept.
+        """
+        kwargs = dict(qtilde=qtilde, onesided=onesided,
+                      onesideddiscovery=onesideddiscovery)
+        flags = (qtilde, onesided, onesideddiscovery)
+
+        def threshold(i):
+            return None if qobs is None else qobs[i]
+
+        def distribution(i):
+            thresholds = None if qobs is None else [qobs[i]]
+            return StreamingDistribution(thresholds, **self._streaming)
+
+        def key(poigen, p, i):
+            q = threshold(i)
+            return (poigen, p) + flags + (None if q is None else float(q),)
+
+        for i, p in enumerate(poinull):
+            if self._qsummary(p, p, flags, threshold(i)) is not None:
+                continue
+            msg = "Streaming null hypothesis toys for {0}."
+            if printlevel >= 0:
+                print(msg.format(p))
+
+            dist = distribution(i)
+            toeval = self.toeval(p, None, qtilde)
+            self._stream_toys(p, self.ntoysnull, toeval, {p: dist}, True,
+                              kwargs)
+            self.qsummaries[key(p, p, i)] = dist
+
+        if poialt is None:
+            return
+
+        dists = {}
+        keys = {}
+        for i, p in enumerate(poinull):
+            if self._qsummary(poialt, p, flags, threshold(i)) is None:
+                dists[p] = distribution(i)
+                keys[p] = key(poialt, p, i)
+
+        if len(dists) > 0:
+            msg = "Streaming alt hypothesis toys for {0}."
+            if printlevel >= 0:
+                print(msg.format(poialt))
+
+            toeval = self.toeval(poialt, list(dists.keys()), qtilde)
+            self._stream_toys(poialt, self.ntoysalt, toeval, dists, False,
+                              kwargs)
+            for p, dist in dists.items():
+                self.qsummaries[keys[p]] = dist
+
+    def _qsummary(self, poigen, poi, flags, q=None):
+        """
+        Returns the StreamingDistribution of the test statistic for **poi**
+        from the toys generated for **poigen**, with the options **flags**
+        (qtilde, onesided, onesideddiscovery), exact at **q**. Without
+        **q** any of them is returned. Returns None if not generated.
+        """
+        if q is not None:
+            return self.qsummaries.get((poigen, poi) + flags + (float(q),))
+        for key, dist in self.qsummaries.items():
+            if key[:-1] == (poigen, poi) + flags:
+                return dist
+        return None
+
+    def _stream_toys(self, poigen, ntoys, toeval, dists, null, kwargs):
+        """
+        Generate **ntoys** toys for **poigen** in batches and fill the
+        distributions **dists** {POI: StreamingDistribution}.
+        """
+        done = 0
+        while done < ntoys:
+            n = min(self.batchsize, ntoys - done)
+            toys = self._dotoys_hypo(poigen, n, toeval, start=done, null=null)
+            for p, dist in dists.items():
+                dist.fill(*self._qtoys(toys, poigen, p, **kwargs))
+            done += n
+
+    @staticmethod
+    def _cls(pnull, palt, errors):
+        cls = pnull / palt
+        rerr_null = errors["pnull"] / np.where(pnull > 0, pnull, 1.)
+        rerr_alt = errors["palt"] / np.where(palt > 0, palt, 1.)
+        err = np.abs(cls) * np.sqrt(rerr_null**2 + rerr_alt**2)
+        return cls, err
+
     def poi_bestfit(self, poigen, qtilde=False):
-        bf = self.toysresults[poigen]["bestfit"]["values"]
+        bf = self.toysresults[poigen].bestfit
         if qtilde:
             bf = np.where(bf < 0, 0, bf)
         return bf
 
     def nll_bestfit(self, poigen, qtilde=False):
-        nll = self.toysresults[poigen]["bestfit"]["nll"]
+        toys = self.toysresults[poigen]
+        nll = toys.nll_bestfit
         if qtilde:
-            bf = self.toysresults[poigen]["bestfit"]["values"]
-            nll_zero = self.nll(poigen, POI(poigen.parameter, 0.))
-            nll = np.where(bf < 0, nll_zero, nll)
+            nll = np.where(toys.bestfit < 0, toys.nll(0.), nll)
         return nll
 
     def nll(self, poigen, poi):
-        return self.toysresults[poigen]["nll"][poi]
+        """
+        Returns the negative log-likelihood of the toys generated for
+        **poigen** evaluated at **poi**, a (ntoys x len(poi)) array if
+        **poi** has several values.
+        """
+        return self.toysresults[poigen].nll(poi.value)
+
+    def weights(self, poigen, poi):
+        """
+        Returns the weights reweighting the toys generated for **poigen** to
+        **poi**, None if the toys are not weighted.
+        """
+        return self.toysresults[poigen].weight(poi.value)
 
     def qnull(self, poi, qtilde=False):
         nll1 = self.nll(poi, poi)
@@ -229,54 +1128,131 @@ class FrequentistCalculator(Calculator):
     def qalt(self, poi, poialt, qtilde=False):
         nll1 = self.nll(poialt, poi)
         nll2 = self.nll_bestfit(poialt, qtilde)
+        if nll1.ndim == 2:
+            nll2 = nll2[:, np.newaxis]
         return self.q(nll1, nll2)
 
-    def pvalue_q(self, qobs, poinull, poialt=None, qtilde=False, onesided=True,
-                 onesideddiscovery=False):
+    def _qtoys(self, toys, poigen, poi, qtilde=False, onesided=True,
+               onesideddiscovery=False):
+        """
+        Returns the values of the test statistic for **poi** of the toys
+        **toys** generated for **poigen**, and their weights.
+        """
+        bestfit = toys.bestfit
+        nllbf = toys.nll_bestfit
+        if qtilde:
+            nllbf = np.where(bestfit < 0, toys.nll(0.), nllbf)
+            bestfit = np.where(bestfit < 0, 0, bestfit)
 
-        def pvalue_i(qdist, qobs):
-            qdist = qdist[~(np.isnan(qdist) | np.isinf(qdist))]
-            p = len(qdist[qdist >= qobs])/len(qdist)
-            return p
+        q = self.q(toys.nll(poi.value), nllbf)
 
-        self.dotoys_null(poinull, poialt, qtilde)
+        weights = toys.weight(poigen.value)
+        if weights is not None:
+            weights = weights[~(np.isnan(q) | np.isinf(q))]
 
-        needpalt = poialt is not None
+        q = self.qdist(q, bestfit, poi.value, onesided=onesided,
+                       onesideddiscovery=onesideddiscovery)
 
-        if needpalt:
-            self.dotoys_alt(poialt, poinull, qtilde)
+        return q, weights
+
+    def qdistribution(self, poigen, poi, qtilde=False, onesided=True,
+                      onesideddiscovery=False, qobs=None):
+        """
+        Returns the empirical distribution of the test statistic for **poi**
+        from the toys generated for **poigen**. With **self.streaming** its
+        StreamingDistribution, exact at **qobs** if given.
+        """
+        if self.streaming:
+            flags = (qtilde, onesided, onesideddiscovery)
+            dist = self._qsummary(poigen, poi, flags, qobs)
+            if dist is None:
+                raise KeyError((poigen, poi) + flags + (qobs,))
+            return dist
+
+        q, weights = self._qtoys(self.toysresults[poigen], poigen, poi,
+                                 qtilde, onesided, onesideddiscovery)
+
+        return EmpiricalDistribution(q, weights)
+
+    def _pvalue_q(self, qobs, poinull, poialt=None, qtilde=False,
+                  onesided=True, onesideddiscovery=False):
+
+        needpalt = poialt is not None
+        kwargs = dict(qtilde=qtilde, onesided=onesided,
+                      onesideddiscovery=onesideddiscovery)
 
         pnull = np.empty(len(poinull))
+        pnull_err = np.empty(len(poinull))
+        nnull = np.empty(len(poinull))
+        essnull = np.empty(len(poinull))
         if needpalt:
             palt = np.empty(len(poinull))
+            palt_err = np.empty(len(poinull))
+            nalt = np.empty(len(poinull))
+            essalt = np.empty(len(poinull))
         else:
             palt = None
 
         for i, p in enumerate(poinull):
-            qnulldist = self.qnull(p, qtilde)
-            bestfitnull = self.poi_bestfit(p, qtilde)
-            qnulldist = self.qdist(qnulldist, bestfitnull, p.value,
-                                   onesided=onesided,
-                                   onesideddiscovery=onesideddiscovery)
-            pnull[i] = pvalue_i(qnulldist, qobs[i])
+            qnulldist = self.qdistribution(p, p, qobs=qobs[i], **kwargs)
+            pnull[i] = qnulldist.sf(qobs[i])
+            pnull_err[i] = qnulldist.sf_error(qobs[i])
+            nnull[i] = qnulldist.n
+            essnull[i] = qnulldist.ess
             if needpalt:
-                qaltdist = self.qalt(p, poialt, qtilde)
-                bestfitalt = self.poi_bestfit(poialt, qtilde)
-                qaltdist = self.qdist(qaltdist, bestfitalt, p.value,
-                                      onesided=onesided,
-                                      onesideddiscovery=onesideddiscovery)
-                palt[i] = pvalue_i(qaltdist, qobs[i])
+                qaltdist = self.qdistribution(poialt, p, qobs=qobs[i],
+                                              **kwargs)
+                palt[i] = qaltdist.sf(qobs[i])
+                palt_err[i] = qaltdist.sf_error(qobs[i])
+                nalt[i] = qaltdist.n
+                essalt[i] = qaltdist.ess
+
+        errors = {"pnull": pnull_err, "ntoysnull": nnull, "essnull": essnull}
+        if needpalt:
+            errors["palt"] = palt_err
+            errors["ntoysalt"] = nalt
+            errors["essalt"] = essalt
 
-        return pnull, palt
+        return pnull, palt, errors
+
+    def pvalue_q(self, qobs, poinull, poialt=None, qtilde=False, onesided=True,
+                 onesideddiscovery=False, errors=False):
+        """
+        Returns the p-values of the null and alternative hypothesis for the
+        observed values **qobs** of the test statistic. If **errors** is True
+        a dictionnary with the binomial uncertainties on the p-values
+        ("pnull", "palt"), the numbers of toys used ("ntoysnull",
+        "ntoysalt") and the effective numbers of weighted toys ("essnull",
+        "essalt") is also returned.
+        """
+
+        if self.streaming:
+            self.dotoys_streaming(qobs, poinull, poialt, qtilde, onesided,
+                                  onesideddiscovery)
+        elif self.stopping is not None:
+            self.dotoys_sequential(qobs, poinull, poialt, qtilde, onesided,
+                                   onesideddiscovery)
+        else:
+            self.dotoys_null(poinull, poialt, qtilde)
+            if poialt is not None:
+                self.dotoys_alt(poialt, poinull, qtilde)
+
+        pnull, palt, errors_ = self._pvalue_q(qobs, poinull, poialt, qtilde,
+                                              onesided, onesideddiscovery)
+
+        if errors:
+            return pnull, palt, errors_
+        else:
+            return pnull, palt
 
     def pvalue(self, poinull, poialt=None, qtilde=False, onesided=True,
-               onesideddiscovery=False):
+               onesideddiscovery=False, errors=False):
 
         qobs = self.qobs(poinull, onesided=onesided, qtilde=qtilde,
                          onesideddiscovery=onesideddiscovery)
 
         return self.pvalue_q(qobs, poinull, poialt, qtilde, onesided,
-                             onesideddiscovery)
+                             onesideddiscovery, errors)
 
     def expected_pvalue(self, poinull, poialt, nsigma, CLs=True, qtilde=False,
                         onesided=True, onesideddiscovery=False):
@@ -284,31 +1260,29 @@ class FrequentistCalculator(Calculator):
         ps = {ns: {"p_clsb": np.empty(len(poinull)),
                    "p_clb": np.empty(len(poinull))} for ns in nsigma}
 
+        kwargs = dict(qtilde=qtilde, onesided=onesided,
+                      onesideddiscovery=onesideddiscovery)
+
+        if self.streaming:
+            self.dotoys_streaming(None, poinull, poialt, **kwargs)
+
         for i, p in enumerate(poinull):
 
-            qnulldist = self.qnull(p)
-            bestfitnull = self.poi_bestfit(p, qtilde)
-            qnulldist = self.qdist(qnulldist, bestfitnull, p.value,
-                                   onesided=onesided,
-                                   onesideddiscovery=onesideddiscovery)
-            qnulldist = qnulldist[~(np.isnan(qnulldist) | np.isinf(qnulldist))]
-
-            qaltdist = self.qalt(p, poialt)
-            bestfitalt = self.poi_bestfit(poialt, qtilde)
-            qaltdist = self.qdist(qaltdist, bestfitalt, p.value,
-                                  onesided=onesided,
-                                  onesideddiscovery=onesideddiscovery)
-            qaltdist = qaltdist[~(np.isnan(qaltdist) | np.isinf(qaltdist))]
-
-            p_clsb_i = np.empty(qnulldist.shape)
-            p_clb_i = np.empty(qaltdist.shape)
-
-            lqnulldist = len(qnulldist)
-            lqaltdist = len(qaltdist)
-
-            for j, q in np.ndenumerate(qaltdist):
-                p_clsb_i[j] = (len(qnulldist[qnulldist >= q])/lqnulldist)
-                p_clb_i[j] = (len(qaltdist[qaltdist >= q])/lqaltdist)
+            qnulldist = self.qdistribution(p, p, **kwargs)
+            qaltdist = self.qdistribution(poialt, p, **kwargs)
+
+            if self.streaming:
+                # the p-values decrease with q, their quantile is the p-value
+                # of the opposite quantile of q
+                for ns in nsigma:
+                    qalt = qaltdist.quantile(1. - norm.cdf(ns))
+                    ps[ns]["p_clsb"][i] = qnulldist.sf(qalt)
+                    ps[ns]["p_clb"][i] = qaltdist.sf(qalt)
+                continue
+
+            # p-values for each alternative toy
+            p_clsb_i = qnulldist.sf(qaltdist.values)
+            p_clb_i = qaltdist.sf(qaltdist.values)
 
             for ns in nsigma:
                 frac = norm.cdf(ns)*100
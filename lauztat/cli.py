@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+"""
+Command line entry points
+"""
+import argparse
+import importlib
+import os
+import numpy as np
+from .toys import merge_toys
+from .util import set_seed
+
+
+def merge_toys_main(argv=None):
+    """
+    lauztat-merge-toys: merge toy files produced by independent jobs.
+    """
+    parser = argparse.ArgumentParser(prog="lauztat-merge-toys",
+                                     description="Merge toy files in the "
+                                     "layout of FrequentistCalculator."
+                                     "toys_to_hdf5.")
+    parser.add_argument("output", help="name of the merged file")
+    parser.add_argument("inputs", nargs="+", help="toy files to merge")
+    parser.add_argument("--compression", default="gzip",
+                        help="compression filter of the merged datasets")
+
+    args = parser.parse_args(argv)
+
+    written = merge_toys(args.inputs, args.output, args.compression)
+    for poigen, ntoys in sorted(written.items()):
+        print("{0} toys merged for {1}.".format(ntoys, poigen))
+
+
+def _load_config(module, name="config"):
+    """
+    Returns the Config defined as **name** in **module**, a python file or
+    an importable module. If **name** is a function it is called without
+    arguments.
+    """
+    if module.endswith(".py"):
+        import importlib.util
+        modname = os.path.splitext(os.path.basename(module))[0]
+        spec = importlib.util.spec_from_file_location(modname, module)
+        mod = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(mod)
+    else:
+        mod = importlib.import_module(module)
+
+    config = getattr(mod, name)
+    if callable(config):
+        config = config()
+    return config
+
+
+def _find_parameter(config, name):
+    for m in config.models:
+        for dep in m.get_dependents():
+            if dep.name == name:
+                return dep
+    return None
+
+
+def _shard(ntoys, job, njobs):
+    """
+    Returns the index of the first toy and the number of toys of the job
+    **job** out of **njobs** jobs generating **ntoys** toys.
+    """
+    chunk = np.array_split(np.arange(ntoys), njobs)[job]
+    start = int(chunk[0]) if len(chunk) > 0 else ntoys
+    return start, len(chunk)
+
+
+def toys_main(argv=None):
+    """
+    lauztat-toys: generate the toys of one job of a batch array job.
+    """
+    parser = argparse.ArgumentParser(prog="lauztat-toys",
+                                     description="Generate the share of "
+                                     "toys of a job, in the layout of "
+                                     "FrequentistCalculator.toys_to_hdf5.")
+    parser.add_argument("module", help="python file or module defining "
+                        "the lauztat.config.Config")
+    parser.add_argument("output", help="name of the hdf5 file of the job")
+    parser.add_argument("--config", default="config",
+                        help="name of the Config, or of a function "
+                        "returning it, in the module")
+    parser.add_argument("--poi", required=True,
+                        help="name of the parameter of interest")
+    parser.add_argument("--values", type=float, nargs="+", required=True,
+                        help="values of the parameter of interest where the "
+                        "toys are generated")
+    parser.add_argument("--eval", type=float, nargs="*", default=[],
+                        help="other values where the negative "
+                        "log-likelihood of the toys is evaluated, e.g. 0 "
+                        "for qtilde or the alternative hypothesis")
+    parser.add_argument("--ntoys", type=int, required=True,
+                        help="number of toys per value, for all the jobs")
+    parser.add_argument("--job", type=int, default=0,
+                        help="index of the job")
+    parser.add_argument("--njobs", type=int, default=1,
+                        help="number of jobs")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the toys, shared by all the jobs, if "
+                        "not given the seed of the Config is used")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes of the job")
+    parser.add_argument("--checkpoint-every", type=int, default=100,
+                        help="number of toys written at once")
+
+    args = parser.parse_args(argv)
+
+    if not 0 <= args.job < args.njobs:
+        parser.error("the job index must be in [0, njobs).")
+
+    from .calculators import FrequentistCalculator
+    from .parameters import POI
+
+    config = _load_config(args.module, args.config)
+    if args.seed is not None:
+        config.seed = args.seed
+    if config.seed is None:
+        parser.error("a seed is needed for the jobs to generate different "
+                     "toys, use --seed.")
+
+    # the toys are sampled from the seed and their index, but a sampling
+    # method of the Config may use the random operations of the library:
+    # each job seeds them with its own seed
+    set_seed(config.models[0],
+             int(np.random.SeedSequence([config.seed, args.job])
+                 .generate_state(1)[0]))
+
+    param = _find_parameter(config, args.poi)
+    if param is None:
+        parser.error("no parameter '{0}' in the models.".format(args.poi))
+
+    toeval = list(args.values)
+    for v in args.eval:
+        if v not in toeval:
+            toeval.append(v)
+    poieval = POI(param, toeval)
+
+    start, ntoys = _shard(args.ntoys, args.job, args.njobs)
+
+    calc = FrequentistCalculator(config, n_workers=args.workers,
+                                 checkpoint=args.output,
+                                 checkpoint_every=args.checkpoint_every)
+
+    for v in args.values:
+        if ntoys == 0:
+            break
+        calc.dotoys(POI(param, v), ntoys, poieval, start=start)
+        msg = "{0} toys generated for {1}={2} (job {3} of {4})."
+        print(msg.format(ntoys, args.poi, v, args.job, args.njobs))
@@ -1,3 +1,61 @@
+import struct
+import hashlib
+import numpy as np
+from .util import get_dataset, get_values, load_sample, sampler_evaluator
+
+
+def toy_seed(seed, value, index, attempt=0):
+    """
+    Returns the seed of the random stream of the toy number **index**
+    generated at the value **value** of the parameter of interest. A toy
+    always gets the same stream whatever the order in which the toys are
+    generated, **attempt** counts the resamplings of a toy with a fit that
+    did not converge.
+    """
+    if value is None:
+        value = 0.
+    value = struct.unpack("<Q", struct.pack("<d", float(value)))[0]
+    entropy = [int(seed), value, int(index), int(attempt)]
+    return int(np.random.SeedSequence(entropy).generate_state(1)[0])
+
+
+def accept_reject(pdf, lower, upper, n, rng):
+    """
+    Returns **n** points sampled from **pdf**, a function of a numpy array of
+    points of shape (m, number of observables), in the box [**lower**,
+    **upper**]. Uniform points drawn from the numpy random Generator **rng**
+    are accepted with a probability proportional to their pdf. The maximum
+    of the pdf is estimated from the points drawn, the points accepted are
+    discarded if a larger maximum is found.
+    """
+    lower = np.atleast_1d(np.asarray(lower, dtype=float))
+    upper = np.atleast_1d(np.asarray(upper, dtype=float))
+
+    accepted = [np.empty((0, len(lower)))]
+    naccepted = 0
+    fmax = 0.
+    efficiency = 0.5
+
+    while naccepted < n:
+        size = int(1.2 * (n - naccepted) / efficiency) + 100
+        x = rng.uniform(lower, upper, size=(size, len(lower)))
+        u = rng.uniform(size=size)
+        f = np.asarray(pdf(x)).reshape(-1)
+
+        if f.max() > fmax:
+            fmax = 1.1 * f.max()
+            accepted = accepted[:1]
+            naccepted = 0
+        elif fmax <= 0:
+            raise ValueError("The pdf is zero in the sampled range.")
+
+        keep = u * fmax < f
+        accepted.append(x[keep])
+        naccepted += np.sum(keep)
+        efficiency = max(np.mean(keep), 0.01)
+
+    return np.concatenate(accepted)[:n]
+
 
 def profileLikelihood(minimizer, loss, var, value):
     with var.set_value(value) as value:
@@ -49,7 +107,7 @@ def base_sample(sampler, ntoys, param=None, value=None, *args, **kwargs):
 class Config(object):
 
     def __init__(self, models, datasets, lossbuilder, minimizer, sampler=None,
-                 sample_method=None, pll=None, bestfit=None):
+                 sample_method=None, pll=None, bestfit=None, seed=None):
 
         if not isinstance(models, (list, tuple)):
             models = [models]
@@ -71,6 +129,8 @@ class Config(object):
         self._sampler = sampler
         self._sample = sample_method
         self._bestfit = bestfit
+        self.seed = seed
+        self._evaluators = {}
 
     def sampler(self, floatting_params=None, *args, **kwargs):
 
@@ -80,12 +140,78 @@ class Config(object):
             return self._sampler(self.models, floatting_params,
                                  *args, **kwargs)
 
-    def sample(self, sampler, ntoys, param=None, value=None):
+    def sample(self, sampler, ntoys, param=None, value=None, start=0,
+               attempt=0):
+        """
+        Returns a generator resampling **sampler** **ntoys** times. If the
+        configuration has a seed, the toys numbered from **start** are
+        sampled from their own random streams, see **toy_seed**: a sampling
+        method given to the configuration gets the seed, **start** and
+        **attempt** as keyword arguments, otherwise the toys are sampled
+        with numpy, see **seeded_sample**.
+        """
 
-        if self._sample is None:
+        if self._sample is not None:
+            if self.seed is None:
+                kwargs = {}
+            else:
+                kwargs = dict(seed=self.seed, start=start, attempt=attempt)
+            return self._sample(sampler, ntoys, param, value, **kwargs)
+        elif self.seed is None:
             return base_sample(sampler, ntoys, param, value)
         else:
-            return self._sample(sampler, ntoys, param, value)
+            return self.seeded_sample(sampler, ntoys, param, value, start,
+                                      attempt)
+
+    def seeded_sample(self, sampler, ntoys, param=None, value=None, start=0,
+                      attempt=0):
+        """
+        Returns a generator sampling the data of **sampler**, a sampler per
+        model, for the toys numbered from **start** to **start** +
+        **ntoys**. Every toy is sampled with numpy by accept-reject from a
+        random Generator seeded with **toy_seed**, the random operations of
+        the library are not used as they can not be seeded per toy.
+        """
+        evaluators = []
+        for m, s in zip(self.models, sampler):
+            if id(s) not in self._evaluators:
+                # the sampler is kept so its id is not reused
+                self._evaluators[id(s)] = (s, sampler_evaluator(m, s))
+            evaluators.append(self._evaluators[id(s)][1])
+
+        for i in range(start, start + ntoys):
+            rng = np.random.default_rng(toy_seed(self.seed, value, i,
+                                                 attempt))
+            for s, (lower, upper, nevents, pdf) in zip(sampler, evaluators):
+                n = nevents(param, value, rng)
+
+                def pdf_(x):
+                    return pdf(x, param, value)
+
+                load_sample(s, accept_reject(pdf_, lower, upper, n, rng))
+
+            yield i
+
+    def fingerprint(self):
+        """
+        Returns a hash of the datasets, the names of the models and of their
+        parameters, which are floating, and the values of the fixed ones.
+        Identifies the configuration across sessions.
+        """
+        sha = hashlib.sha1()
+        for m, d in zip(self.models, self.datasets):
+            deps = sorted(m.get_dependents(), key=lambda p: p.name)
+            fixed = get_values([p for p in deps if not p.floating])
+            params = [(p.name, p.floating, fixed.get(p)) for p in deps]
+            sha.update(repr((getattr(m, "name", None), params)).encode())
+
+            values, weights = get_dataset(d)
+            sha.update(np.ascontiguousarray(values, dtype=float).tobytes())
+            if weights is not None:
+                weights = np.ascontiguousarray(weights, dtype=float)
+                sha.update(weights.tobytes())
+
+        return sha.hexdigest()
 
     def obsloss(self):
         return self.lossbuilder(self.models, self.datasets)
@@ -119,6 +245,20 @@ class Config(object):
         """
         self._bestfit = value
 
+    def nuisances(self, poiparam=None):
+        """
+        Returns the floating parameters of the models, except **poiparam**.
+        """
+        ret = []
+        for m in self.models:
+            for dep in m.get_dependents():
+                if not dep.floating or dep in ret:
+                    continue
+                if poiparam is not None and dep.name == poiparam.name:
+                    continue
+                ret.append(dep)
+        return ret
+
     def deps_tobestfit(self):
         for m in self.models:
             for dep in m.get_dependents():
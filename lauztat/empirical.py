@@ -0,0 +1,259 @@
+#!/usr/bin/python
+
+"""
+Empirical distributions of test statistics
+"""
+import numpy as np
+
+
+def binomial_error(p, n):
+    """
+    Binomial uncertainty on a p-value estimated with **n** toys. The p-value
+    is regularized to not get a null uncertainty for p = 0 or p = 1.
+    """
+    n = np.asarray(n, dtype=float)
+    p_ = (p * n + 0.5) / (n + 1.)
+    return np.sqrt(p_ * (1. - p_) / n)
+
+
+class EmpiricalDistribution(object):
+    """
+    Empirical distribution of a test statistic, built once from the values
+    obtained with toys. The values are sorted and the nan/inf values removed
+    so the tail probabilities of arrays of values are computed with a binary
+    search.
+
+        **Arguments:**
+
+            - **q** array of values of the test statistic
+            - **weights** (optionnal) array of weights of the toys
+
+        **Example:**
+            dist = EmpiricalDistribution(qnull)
+            pvalues = dist.sf(qobs)
+    """
+
+    def __init__(self, q, weights=None):
+
+        q = np.asarray(q, dtype=float)
+        sel = ~(np.isnan(q) | np.isinf(q))
+        q = q[sel]
+
+        order = np.argsort(q, kind="mergesort")
+        self.values = q[order]
+        self.n = len(q)
+
+        if weights is not None:
+            weights = np.asarray(weights, dtype=float)[sel][order]
+
+            def tail(w):
+                return np.concatenate([np.cumsum(w[::-1])[::-1], [0.]])
+
+            self._tail_w = tail(weights)
+            self._tail_w2 = tail(weights**2)
+
+        self.weights = weights
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def ess(self):
+        """
+        Returns the effective number of toys, (sum w)^2 / sum w^2 for
+        weighted toys.
+        """
+        if self.weights is None:
+            return float(self.n)
+        return self._tail_w[0]**2 / self._tail_w2[0]
+
+    def _tail(self, q):
+        # index of the first value >= q
+        return np.searchsorted(self.values, q, side="left")
+
+    def sf(self, q):
+        """
+        Returns the fraction of toys with a value of the test statistic
+        greater or equal to **q**.
+        """
+        i = self._tail(q)
+        if self.weights is None:
+            return (self.n - i) / self.n
+        else:
+            return self._tail_w[i] / self.n
+
+    def sf_error(self, q):
+        """
+        Returns the uncertainty on **sf(q)**, binomial for unweighted toys,
+        from the variance of the weights in the tail otherwise.
+        """
+        if self.weights is None:
+            return binomial_error(self.sf(q), self.n)
+        else:
+            i = self._tail(q)
+            mean = self._tail_w[i] / self.n
+            var = self._tail_w2[i] / self.n - mean**2
+            return np.sqrt(np.maximum(var, 0.) / self.n)
+
+
+class StreamingDistribution(object):
+    """
+    Bounded memory summary of the distribution of a test statistic, filled
+    with batches of values from toys that are then discarded. The tail
+    probabilities at the **thresholds**, e.g. the observed values of the test
+    statistic, are exact. The other tail probabilities and the quantiles are
+    interpolated from a histogram of the values in **nbins** bins of sqrt(q)
+    between 0 and **qmax**, with a bin for the values <= 0 and an overflow
+    bin. Summaries with the same bins and thresholds can be merged.
+
+        **Arguments:**
+
+            - **thresholds** (optionnal) values where the tail probabilities
+            are exact
+            - **nbins** number of bins of the histogram
+            - **qmax** upper edge of the histogram
+
+        **Example:**
+            dist = StreamingDistribution(thresholds=[qobs])
+            for q in batches:
+                dist.fill(q)
+            pvalue = dist.sf(qobs)
+    """
+
+    def __init__(self, thresholds=None, nbins=200, qmax=100.):
+
+        if thresholds is None:
+            thresholds = []
+        self.thresholds = np.asarray(thresholds, dtype=float).ravel()
+        self.nbins = nbins
+        self.qmax = qmax
+        self._sqrt_edges = np.linspace(0., np.sqrt(qmax), nbins + 1)
+        self.edges = self._sqrt_edges**2
+
+        self.n = 0
+        self.weighted = False
+        # bin 0: q <= 0, bins 1 to nbins: histogram, bin nbins + 1: overflow
+        self._w = np.zeros(nbins + 2)
+        self._w2 = np.zeros(nbins + 2)
+        self._tail_w = np.zeros(len(self.thresholds))
+        self._tail_w2 = np.zeros(len(self.thresholds))
+
+    def __len__(self):
+        return self.n
+
+    def fill(self, q, weights=None):
+        """
+        Add the values **q** of the test statistic, with their **weights**
+        (optionnal).
+        """
+        q = np.asarray(q, dtype=float).ravel()
+        sel = ~(np.isnan(q) | np.isinf(q))
+        q = q[sel]
+
+        if weights is None:
+            w = np.ones(len(q))
+        else:
+            w = np.asarray(weights, dtype=float).ravel()[sel]
+            self.weighted = True
+
+        self.n += len(q)
+
+        bins = np.searchsorted(self.edges, q, side="left")
+        bins = np.where(q > self.qmax, self.nbins + 1, bins)
+        np.add.at(self._w, bins, w)
+        np.add.at(self._w2, bins, w**2)
+
+        above = q[:, np.newaxis] >= self.thresholds[np.newaxis, :]
+        self._tail_w += np.dot(w, above)
+        self._tail_w2 += np.dot(w**2, above)
+
+    def merge(self, other):
+        """
+        Add the values of the StreamingDistribution **other**.
+        """
+        same = (np.array_equal(self.edges, other.edges) and
+                np.array_equal(self.thresholds, other.thresholds))
+        if not same:
+            msg = "Can not merge distributions with different bins or "
+            msg += "thresholds."
+            raise ValueError(msg)
+
+        self.n += other.n
+        self.weighted = self.weighted or other.weighted
+        self._w += other._w
+        self._w2 += other._w2
+        self._tail_w += other._tail_w
+        self._tail_w2 += other._tail_w2
+
+    @property
+    def ess(self):
+        """
+        Returns the effective number of toys, (sum w)^2 / sum w^2 for
+        weighted toys.
+        """
+        if not self.weighted:
+            return float(self.n)
+        return np.sum(self._w)**2 / np.sum(self._w2)
+
+    def _hist_tail(self, w, q):
+        # sum of w for the values >= q, linear in sqrt(q) inside a bin
+        tail = np.concatenate([np.cumsum(w[::-1])[::-1], [0.]])
+        s = np.sqrt(np.clip(q, 0., self.qmax))
+        k = np.clip(np.searchsorted(self._sqrt_edges, s, side="left"), 1,
+                    self.nbins)
+        lo, hi = self._sqrt_edges[k - 1], self._sqrt_edges[k]
+        ret = tail[k + 1] + (hi - s) / (hi - lo) * w[k]
+        ret = np.where(q <= 0, tail[0], ret)
+        return np.where(q > self.qmax, tail[-2], ret)
+
+    def _tails(self, q):
+        q = np.asarray(q, dtype=float)
+        tw = self._hist_tail(self._w, q)
+        tw2 = self._hist_tail(self._w2, q)
+        for j, t in enumerate(self.thresholds):
+            exact = q == t
+            tw = np.where(exact, self._tail_w[j], tw)
+            tw2 = np.where(exact, self._tail_w2[j], tw2)
+        return tw, tw2
+
+    def sf(self, q):
+        """
+        Returns the fraction of toys with a value of the test statistic
+        greater or equal to **q**.
+        """
+        tw, _ = self._tails(q)
+        return tw / self.n
+
+    def sf_error(self, q):
+        """
+        Returns the uncertainty on **sf(q)**, binomial for unweighted toys,
+        from the variance of the weights in the tail otherwise.
+        """
+        tw, tw2 = self._tails(q)
+        if not self.weighted:
+            return binomial_error(tw / self.n, self.n)
+        else:
+            mean = tw / self.n
+            var = tw2 / self.n - mean**2
+            return np.sqrt(np.maximum(var, 0.) / self.n)
+
+    def quantile(self, p):
+        """
+        Returns the value of the test statistic below which lies the fraction
+        **p** of the toys.
+        """
+        p = np.asarray(p, dtype=float)
+        cum = np.cumsum(self._w)
+        target = p * cum[-1]
+
+        k = np.clip(np.searchsorted(cum, target, side="left"), 0,
+                    self.nbins + 1)
+        inside = (k > 0) & (k <= self.nbins)
+        k_ = np.clip(k, 1, self.nbins)
+        lo, hi = self._sqrt_edges[k_ - 1], self._sqrt_edges[k_]
+        w = np.where(self._w[k_] > 0, self._w[k_], 1.)
+        frac = np.clip((target - cum[k_ - 1]) / w, 0., 1.)
+        s = lo + frac * (hi - lo)
+
+        ret = np.where(inside, s**2, 0.)
+        return np.where(k > self.nbins, self.qmax, ret)
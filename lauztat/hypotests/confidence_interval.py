@@ -1,6 +1,10 @@
 from .hypotest import HypoTest
 from scipy.interpolate import interp1d
+from scipy.optimize import brentq
 import numpy as np
+from ..parameters import POI
+from ..util import hesse_error
+from ..calculators import AsymptoticCalculator
 
 
 class ConfidenceInterval(HypoTest):
@@ -89,6 +93,110 @@ class ConfidenceInterval(HypoTest):
 
         return bands
 
+    def interval_rootfinding(self, alpha=0.32, xtol=None, maxiter=20,
+                             printlevel=1):
+        """
+        Returns the confidence interval on the parameter of interest, with
+        its ends found with a root finder (Brent's method) on 1-CL minus
+        **alpha** on each side of the best fit, instead of a scan of
+        **poinull**. The range of **poinull** only gives the starting
+        brackets, which are widened if needed. If **alpha** is a list, e.g.
+        [0.32, 0.05], a list of intervals is returned and the p-values
+        computed for an interval are reused to bracket the others. The
+        number of profile likelihood fits done is returned in "nfits". Can
+        only be used with an AsymptoticCalculator.
+
+            **Arguments:**
+                - **alpha** 1-CL, or a list of 1-CL
+                - **xtol** (optionnal) absolute tolerance on the ends of the
+                intervals, by default 1e-4 times the range of **poinull**,
+                or of the uncertainty on the best fit if **poinull** has a
+                single value
+                - **maxiter** maximal number of widenings of a bracket
+                - **printlevel** printing level
+        """
+        calc = self.calculator
+        if not isinstance(calc, AsymptoticCalculator):
+            msg = "The root finding of the confidence interval requires an "
+            msg += "AsymptoticCalculator."
+            raise TypeError(msg)
+
+        poiname = self.poinull.name
+        poiparam = self.poinull.parameter
+        poivalues = np.asarray(self.poinull.value, dtype=float)
+        observed = calc.config.bestfit.params[poiparam]["value"]
+        nfits = calc.nfits
+
+        width = np.max(poivalues) - np.min(poivalues)
+        if width <= 0:
+            # a single value in **poinull**, the scale is given by the
+            # uncertainty on the best fit
+            width = hesse_error(calc.config.bestfit, poiparam)
+
+        if xtol is None:
+            xtol = 1e-4 * width
+
+        # p-values computed, 1 at the best fit
+        evaluated = {observed: 1.}
+
+        def pvalue(x):
+            if x not in evaluated:
+                pnull, _ = calc.pvalue(POI(poiparam, x), qtilde=self.qtilde,
+                                       onesided=False)
+                evaluated[x] = float(np.ravel(pnull)[0])
+            return evaluated[x]
+
+        def end(a, side):
+            # closest evaluated point past the crossing, the p-value decreases
+            # with the distance to the best fit
+            def distance(x):
+                return side * (x - observed)
+
+            points = [x for x in evaluated.keys() if distance(x) >= 0]
+            inner = max([x for x in points if evaluated[x] >= a],
+                        key=distance)
+            outer = [x for x in points if evaluated[x] < a]
+
+            if len(outer) > 0:
+                outer = min(outer, key=distance)
+            else:
+                outer = np.max(poivalues) if side > 0 else np.min(poivalues)
+                if distance(outer) <= distance(inner):
+                    outer = inner + side * max(distance(inner), width)
+                for _ in range(maxiter):
+                    if pvalue(outer) < a:
+                        break
+                    inner = outer
+                    outer = observed + 2 * (outer - observed)
+                else:
+                    return None
+
+            lo, hi = sorted([inner, outer])
+            return brentq(lambda x: pvalue(x) - a, lo, hi, xtol=xtol)
+
+        alphas = np.atleast_1d(alpha)
+        ret = []
+        for a in alphas:
+            bands = {}
+            bands["observed"] = observed
+            bands["band_p"] = end(a, 1)
+            bands["band_m"] = end(a, -1)
+            bands["nfits"] = calc.nfits - nfits
+            ret.append(bands)
+
+            if printlevel > 0:
+                msg = "\nConfidence interval on {0}:\n"
+                msg += "\t{band_m} < {0} < {band_p} at {1:.1f}% C.L."
+                print(msg.format(poiname, (1 - a)*100, **bands))
+
+        if printlevel > 0:
+            print("{0} profile likelihood fits.".format(calc.nfits - nfits))
+
+        if np.ndim(alpha) == 0:
+            return ret[0]
+        else:
+            return ret
+
     def plot(self, alpha=0.32, ax=None, show=True, **kwargs):
 
         import matplotlib.pyplot as plt
@@ -1,7 +1,10 @@
 from .hypotest import HypoTest
 from scipy.interpolate import InterpolatedUnivariateSpline
+from scipy.optimize import brentq
+import numpy as np
 from ..parameters import POI
-from ..calculators import AsymptoticCalculator
+from ..util import hesse_error
+from ..calculators import AsymptoticCalculator, FrequentistCalculator
 
 
 class UpperLimit(HypoTest):
@@ -91,7 +94,6 @@ class UpperLimit(HypoTest):
         pvalues = self.pvalues()
         poinull = self.poinull
         poivalues = poinull.value
-        poiname = poinull.name
         poiparam = poinull.parameter
 
         bestfitpoi = self.calculator.config.bestfit.params[poiparam]["value"]
@@ -142,22 +144,243 @@ class UpperLimit(HypoTest):
                 values[k_] = r
 
         if printlevel > 0:
+            self._print_limits(values)
 
-            msg = "\nObserved upper limit: {0} = {1}"
-            print(msg.format(poiname, values["observed"]))
-            msg = "Expected upper limit: {0} = {1}"
-            print(msg.format(poiname, values["exp"]))
-            msg = "Expected upper limit +1 sigma: {0} = {1}"
-            print(msg.format(poiname, values["exp_p1"]))
-            msg = "Expected upper limit -1 sigma: {0} = {1}"
-            print(msg.format(poiname, values["exp_m1"]))
-            msg = "Expected upper limit +2 sigma: {0} = {1}"
-            print(msg.format(poiname, values["exp_p2"]))
-            msg = "Expected upper limit -2 sigma: {0} = {1}"
-            print(msg.format(poiname, values["exp_m2"]))
+        return values
+
+    def _print_limits(self, values):
+
+        poiname = self.poinull.name
+
+        msg = "\nObserved upper limit: {0} = {1}"
+        print(msg.format(poiname, values["observed"]))
+        msg = "Expected upper limit: {0} = {1}"
+        print(msg.format(poiname, values["exp"]))
+        msg = "Expected upper limit +1 sigma: {0} = {1}"
+        print(msg.format(poiname, values["exp_p1"]))
+        msg = "Expected upper limit -1 sigma: {0} = {1}"
+        print(msg.format(poiname, values["exp_m1"]))
+        msg = "Expected upper limit +2 sigma: {0} = {1}"
+        print(msg.format(poiname, values["exp_p2"]))
+        msg = "Expected upper limit -2 sigma: {0} = {1}"
+        print(msg.format(poiname, values["exp_m2"]))
+
+    def upperlimit_rootfinding(self, bounds=None, xtol=1e-3, maxiter=10,
+                               printlevel=1):
+        """
+        Returns the observed and expected upper limits of the parameter of
+        interest. The observed limit is found with a root finder (Brent's
+        method) on the p-value minus alpha instead of a scan of **poinull**,
+        the expected limits are computed from it in closed form. Only the
+        values of the parameter of interest visited by the root finder are
+        fitted, their number is returned in "nfits". Can only be used with
+        an AsymptoticCalculator.
+
+            **Arguments:**
+                - **bounds** (optionnal) interval where the limits are
+                searched, by default from the best fit to the largest value
+                of **poinull**. The upper bound is pushed further if the
+                limit is above, the best fit is used as lower bound if the
+                limit is below.
+                - **xtol** absolute tolerance on the limits
+                - **maxiter** maximal number of extensions of the upper
+                bound
+                - **printlevel** printing level
+        """
+        calc = self.calculator
+        if not isinstance(calc, AsymptoticCalculator):
+            msg = "The root finding of the upper limits requires an "
+            msg += "AsymptoticCalculator."
+            raise TypeError(msg)
+
+        poiparam = self.poinull.parameter
+        poivalues = np.asarray(self.poinull.value, dtype=float)
+        bestfitpoi = calc.config.bestfit.params[poiparam]["value"]
+        nfits = calc.nfits
+
+        if bounds is None:
+            # the p-value at the best fit is at least 0.5, above alpha
+            upper = np.max(poivalues)
+            if upper <= bestfitpoi:
+                upper = bestfitpoi + hesse_error(calc.config.bestfit,
+                                                 poiparam)
+            bounds = (bestfitpoi, upper)
+
+        def pvalue(value):
+            poi = POI(poiparam, value)
+            pnull, palt = calc.pvalue(poi, self.poialt, qtilde=self.qtilde,
+                                      onesided=True)
+            p = pnull / palt if self.CLs else pnull
+            return float(np.ravel(p)[0]) - self.alpha
+
+        def bracket(f):
+            lo, hi = bounds
+            if f(lo) < 0:
+                # the limit is between the best fit and the lower bound
+                if lo <= bestfitpoi or f(bestfitpoi) < 0:
+                    return None
+                return bestfitpoi, lo
+            width = hi - lo
+            for _ in range(maxiter):
+                if f(hi) < 0:
+                    return lo, hi
+                lo, hi = hi, hi + 2 * width
+                width = hi - lo
+            return None
+
+        values = {}
+        interval = bracket(pvalue)
+        if interval is None:
+            values["observed"] = None
+        else:
+            values["observed"] = brentq(pvalue, *interval, xtol=xtol)
+
+        # the expected limits are computed at the observed limit, as in
+        # **upperlimit**
+        keys = ["exp", "exp_p1", "exp_p2", "exp_m1", "exp_m2"]
+        if values["observed"] is None:
+            results = [None] * len(keys)
+        else:
+            poiul = POI(poiparam, values["observed"])
+            sigmas = [0.0, 1.0, 2.0, -1.0, -2.0]
+            results = calc.expected_poi(poinull=poiul, poialt=self.poialt,
+                                        nsigma=sigmas, alpha=self.alpha,
+                                        CLs=self.CLs)
+
+        for r, k in zip(results, keys):
+            values[k] = r
+
+        values["nfits"] = calc.nfits - nfits
+
+        if printlevel > 0:
+            self._print_limits(values)
+            print("{0} profile likelihood fits.".format(values["nfits"]))
 
         return values
 
+    def _crossing(self, pvalues, bestfitpoi):
+        """
+        Returns the indices in **self.poinull** of the two values of the
+        parameter of interest above **bestfitpoi** bracketing the crossing of
+        **pvalues** with alpha, and the crossing linearly interpolated. None
+        if there is no crossing.
+        """
+        poivalues = self.poinull.value
+        order = [i for i in np.argsort(poivalues)
+                 if poivalues[i] > bestfitpoi]
+
+        for i, j in zip(order[:-1], order[1:]):
+            p_i = pvalues[i] - self.alpha
+            p_j = pvalues[j] - self.alpha
+            if p_i >= 0 > p_j:
+                x_i, x_j = poivalues[i], poivalues[j]
+                return (i, j), x_i + p_i * (x_j - x_i) / (p_i - p_j)
+
+        return None, None
+
+    def adaptive_upperlimit(self, pilot=200, batchsize=200, rtol=0.01,
+                            maxiter=50, printlevel=1):
+        """
+        Returns the upper limit of the parameter of interest with the toys
+        concentrated where they matter, near the crossing of the p-values
+        with alpha. A pilot pass with **pilot** toys for each value of the
+        parameter of interest locates the crossing of the observed and
+        median expected p-values, then **batchsize** toys are added at the
+        values bracketing these crossings until the interpolated limits
+        change by less than **rtol** (relative), or the numbers of toys of
+        the calculator are reached.
+
+            **Arguments:**
+                - **pilot** number of toys of the pilot pass
+                - **batchsize** number of toys added at each iteration
+                - **rtol** relative tolerance on the upper limits
+                - **maxiter** maximal number of iterations
+                - **printlevel** printing level
+        """
+        calc = self.calculator
+        if not isinstance(calc, FrequentistCalculator):
+            msg = "The adaptive upper limit requires a FrequentistCalculator."
+            raise TypeError(msg)
+        if (calc.streaming or calc.anchors is not None or
+                calc.stopping is not None):
+            msg = "The adaptive upper limit requires the toys in memory, "
+            msg += "without anchors or stopping rule."
+            raise ValueError(msg)
+
+        poinull = self.poinull
+        poialt = self.poialt
+        qtilde = self.qtilde
+        poiparam = poinull.parameter
+
+        bestfitpoi = calc.config.bestfit.params[poiparam]["value"]
+        qobs = calc.qobs(poinull, onesided=True, qtilde=qtilde)
+
+        def extend(p, ntoys, null):
+            n = min(ntoys, calc.ntoysnull if null else calc.ntoysalt)
+            n -= calc.ntoys(p)
+            if n <= 0:
+                return False
+            if null:
+                toeval = calc.toeval(p, poialt, qtilde)
+            else:
+                toeval = calc.toeval(p, poinull, qtilde)
+            calc.extend_toys(p, n, toeval, null=null)
+            return True
+
+        for p in poinull:
+            extend(p, pilot, True)
+        extend(poialt, pilot, False)
+
+        previous = None
+        for it in range(maxiter):
+            pnull, palt, _ = calc.pvalue_q(qobs, poinull, poialt, qtilde,
+                                           errors=True)
+            if self.CLs:
+                pobs = pnull / palt
+            else:
+                pobs = pnull
+            pexp = calc.expected_pvalue(poinull, poialt, [0.], self.CLs,
+                                        qtilde)[0]
+
+            brackets = []
+            limits = []
+            for p_ in [pobs, pexp]:
+                bracket, limit = self._crossing(p_, bestfitpoi)
+                if bracket is not None:
+                    brackets.append(bracket)
+                    limits.append(limit)
+            limits = np.array(limits)
+
+            if len(limits) == 0:
+                if printlevel > 0:
+                    print("No crossing of the p-values with alpha found.")
+                break
+
+            if printlevel > 0:
+                msg = "Iteration {0}: limits {1}."
+                print(msg.format(it, limits))
+
+            if previous is not None and len(previous) == len(limits):
+                if np.all(np.abs(limits - previous) <= rtol * np.abs(limits)):
+                    break
+            previous = limits
+
+            extended = False
+            for i in set(i for b in brackets for i in b):
+                p = poinull[i]
+                extended |= extend(p, calc.ntoys(p) + batchsize, True)
+            extended |= extend(poialt, calc.ntoys(poialt) + batchsize, False)
+
+            if not extended:
+                break
+
+        if printlevel > 0:
+            ntoys = sum(calc.ntoys(p) for p in poinull) + calc.ntoys(poialt)
+            print("{0} toys generated in total.".format(ntoys))
+
+        self._pvalues = self._scannll()
+        return self.upperlimit(printlevel=printlevel)
+
     def plot(self, ax=None, show=True, **kwargs):
         """
         Plot the pvalues obtained with CLsb/CLb/CLs, and using the asimov
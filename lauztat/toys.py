@@ -0,0 +1,537 @@
+#!/usr/bin/python
+
+"""
+Storage of toy results
+"""
+import numpy as np
+
+
+class ToyResult(object):
+    """
+    Results of the toys generated for one value of the parameter of interest.
+    The negative log-likelihood values of the toys are stored in a single
+    (ntoys x number of evaluated values) array, with the best fit value and
+    negative log-likelihood of each toy in separate columns.
+
+        **Arguments:**
+
+            - **poigen** value of the parameter of interest used to generate
+            the toys
+            - **evaluated** values of the parameter of interest for which the
+            negative log-likelihood of the toys are computed
+            - **ntoys** number of toys
+            - **weighted** (optionnal) values of the parameter of interest the
+            toys are reweighted to
+
+        **Example:**
+            toys = ToyResult(1.0, [1.0, 0.0], 1000)
+            toys.nll(1.0)
+            toys.nll([1.0, 0.0])
+    """
+
+    def __init__(self, poigen, evaluated, ntoys, weighted=None):
+
+        evaluated = [float(v) for v in evaluated]
+        if weighted is None:
+            weighted = []
+        weighted = [float(v) for v in weighted]
+
+        self.poigen = float(poigen)
+        self.evaluated = evaluated
+        self.weighted = weighted
+        self._columns = {v: i for i, v in enumerate(evaluated)}
+        self._wcolumns = {v: i for i, v in enumerate(weighted)}
+
+        self.bestfit = np.empty(ntoys)
+        self.nll_bestfit = np.empty(ntoys)
+        self.index = np.arange(ntoys)
+        self.nlls = np.empty((ntoys, len(evaluated)))
+        self.weights = np.empty((ntoys, len(weighted)))
+
+    def __len__(self):
+        return len(self.bestfit)
+
+    def __repr__(self):
+        msg = "ToyResult(poigen={0}, ntoys={1}, evaluated={2})"
+        return msg.format(self.poigen, len(self), self.evaluated)
+
+    def _column(self, values, columns):
+        if np.ndim(values) == 0:
+            return columns[float(values)]
+        else:
+            return [columns[float(v)] for v in values]
+
+    def has(self, value):
+        """
+        Returns True if the negative log-likelihood of the toys is computed
+        for **value**.
+        """
+        return float(value) in self._columns
+
+    def nll(self, values):
+        """
+        Returns the negative log-likelihood of the toys for **values**, a
+        single value (ntoys array) or a list of values (ntoys x nvalues
+        array).
+        """
+        return self.nlls[:, self._column(values, self._columns)]
+
+    def weight(self, value):
+        """
+        Returns the weights reweighting the toys to **value**, None if the
+        toys are not reweighted to this value.
+        """
+        if float(value) not in self._wcolumns:
+            return None
+        return self.weights[:, self._wcolumns[float(value)]]
+
+    def ess(self, value):
+        """
+        Returns the effective number of toys reweighted to **value**, the
+        number of toys if they are not reweighted.
+        """
+        w = self.weight(value)
+        if w is None:
+            return float(len(self))
+        return np.sum(w)**2 / np.sum(w**2)
+
+    def fill(self, i, bestfit, nll_bestfit, nlls, weights=None):
+        """
+        Fill the results of the toy number **i**.
+        """
+        self.bestfit[i] = bestfit
+        self.nll_bestfit[i] = nll_bestfit
+        self.nlls[i] = nlls
+        if weights is not None:
+            self.weights[i] = weights
+
+    def append(self, other):
+        """
+        Append the toys of **other**, evaluated and reweighted at the same
+        values.
+        """
+        other_nlls = other.nll(self.evaluated)
+        other_weights = other.weights[:, other._column(self.weighted,
+                                                       other._wcolumns)]
+
+        self.bestfit = np.concatenate([self.bestfit, other.bestfit])
+        self.nll_bestfit = np.concatenate([self.nll_bestfit,
+                                           other.nll_bestfit])
+        self.index = np.concatenate([self.index, other.index])
+        self.nlls = np.concatenate([self.nlls, other_nlls])
+        self.weights = np.concatenate([self.weights, other_weights])
+
+    @classmethod
+    def concatenate(cls, results):
+        """
+        Returns the concatenation of a list of ToyResult.
+        """
+        ret = cls.from_arrays(results[0].poigen, results[0].bestfit,
+                              results[0].nll_bestfit, results[0].evaluated,
+                              results[0].nlls, results[0].index,
+                              results[0].weighted, results[0].weights)
+        for r in results[1:]:
+            ret.append(r)
+        return ret
+
+    @classmethod
+    def from_arrays(cls, poigen, bestfit, nll_bestfit, evaluated, nlls,
+                    index=None, weighted=None, weights=None):
+        """
+        Build a ToyResult from arrays.
+        """
+        ret = cls(poigen, evaluated, 0, weighted)
+        ret.bestfit = np.asarray(bestfit, dtype=float)
+        ret.nll_bestfit = np.asarray(nll_bestfit, dtype=float)
+        ret.nlls = np.asarray(nlls, dtype=float).reshape(len(ret.bestfit),
+                                                         len(evaluated))
+        if index is None:
+            index = np.arange(len(ret.bestfit))
+        ret.index = np.asarray(index)
+        if weights is None:
+            weights = np.empty((len(ret.bestfit), 0))
+        ret.weights = np.asarray(weights, dtype=float)
+        ret.weights = ret.weights.reshape(len(ret.bestfit), len(ret.weighted))
+        return ret
+
+    @classmethod
+    def from_dict(cls, poigen, toys):
+        """
+        Build a ToyResult from a dictionnary in the layout of the hdf5 files:
+        {"bestfit": {"values": array, "nll": array, "index": array},
+        "nll": {value: array}, "weights": {value: array}}.
+        """
+        bestfit = toys["bestfit"]
+        evaluated = list(toys["nll"].keys())
+        nlls = np.column_stack([toys["nll"][v] for v in evaluated])
+
+        weighted = list(toys.get("weights", {}).keys())
+        if len(weighted) > 0:
+            weights = np.column_stack([toys["weights"][v] for v in weighted])
+        else:
+            weights = None
+
+        return cls.from_arrays(poigen, bestfit["values"], bestfit["nll"],
+                               evaluated, nlls, bestfit.get("index", None),
+                               weighted, weights)
+
+    def select(self, selection):
+        """
+        Returns a ToyResult with the toys selected by **selection**, a
+        boolean mask or an array of indices.
+        """
+        return ToyResult.from_arrays(self.poigen, self.bestfit[selection],
+                                     self.nll_bestfit[selection],
+                                     self.evaluated, self.nlls[selection],
+                                     self.index[selection], self.weighted,
+                                     self.weights[selection])
+
+    def to_dict(self):
+        """
+        Returns the toys in a dictionnary in the layout of the hdf5 files.
+        """
+        ret = {"bestfit": {"values": self.bestfit, "nll": self.nll_bestfit,
+                           "index": self.index}}
+        ret["nll"] = {v: self.nll(v) for v in self.evaluated}
+        if len(self.weighted) > 0:
+            ret["weights"] = {v: self.weight(v) for v in self.weighted}
+        return ret
+
+
+def load_dataset(dataset):
+    """
+    Returns the content of an hdf5 dataset, as a read-only memory map if the
+    dataset is stored contiguously and uncompressed in the file.
+    """
+    offset = dataset.id.get_offset()
+    contiguous = dataset.chunks is None and dataset.compression is None
+    if contiguous and offset is not None:
+        return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode="r",
+                         offset=offset, shape=dataset.shape)
+    else:
+        return dataset[...]
+
+
+class LazyToyResult(object):
+    """
+    Toys stored in a group of an hdf5 file, in the layout of
+    FrequentistCalculator.toys_to_hdf5, with the same interface as ToyResult.
+    The datasets are only read, or memory mapped, when they are accessed.
+
+        **Arguments:**
+
+            - **group** the h5py group of the toys
+            - **poigen** value of the parameter of interest used to generate
+            the toys
+    """
+
+    def __init__(self, group, poigen):
+
+        self.poigen = float(poigen)
+        self._group = group
+        self._names = {}
+        for j in ["nll", "weights"]:
+            if j in group:
+                self._names[j] = {float(k): k for k in group[j].keys()}
+            else:
+                self._names[j] = {}
+        self.evaluated = list(self._names["nll"].keys())
+        self.weighted = list(self._names["weights"].keys())
+        self._cache = {}
+
+    def __len__(self):
+        return len(self._group["bestfit"]["values"])
+
+    def __repr__(self):
+        msg = "LazyToyResult(poigen={0}, ntoys={1}, evaluated={2})"
+        return msg.format(self.poigen, len(self), self.evaluated)
+
+    def _dataset(self, j, o):
+        key = (j, o)
+        if key not in self._cache:
+            self._cache[key] = load_dataset(self._group[j][o])
+        return self._cache[key]
+
+    @property
+    def bestfit(self):
+        return self._dataset("bestfit", "values")
+
+    @property
+    def nll_bestfit(self):
+        return self._dataset("bestfit", "nll")
+
+    @property
+    def index(self):
+        if "index" in self._group["bestfit"]:
+            return self._dataset("bestfit", "index")
+        else:
+            return np.arange(len(self))
+
+    def has(self, value):
+        return float(value) in self._names["nll"]
+
+    def nll(self, values):
+        if np.ndim(values) == 0:
+            return self._dataset("nll", self._names["nll"][float(values)])
+        else:
+            return np.column_stack([self.nll(v) for v in values])
+
+    def weight(self, value):
+        if float(value) not in self._names["weights"]:
+            return None
+        return self._dataset("weights", self._names["weights"][float(value)])
+
+    def ess(self, value):
+        w = self.weight(value)
+        if w is None:
+            return float(len(self))
+        return np.sum(w)**2 / np.sum(w**2)
+
+    def to_dict(self):
+        ret = {"bestfit": {"values": self.bestfit, "nll": self.nll_bestfit,
+                           "index": self.index}}
+        ret["nll"] = {v: self.nll(v) for v in self.evaluated}
+        if len(self.weighted) > 0:
+            ret["weights"] = {v: self.weight(v) for v in self.weighted}
+        return ret
+
+    def load(self):
+        """
+        Returns a ToyResult with all the toys read in memory.
+        """
+        return ToyResult.from_dict(self.poigen, self.to_dict())
+
+
+class ToyWriter(object):
+    """
+    Writes toys incrementally to an hdf5 file, in the layout of
+    FrequentistCalculator.toys_to_hdf5 but with chunked and resizable
+    datasets, so toys can be appended and a run can be resumed from the toys
+    already stored. If a write is interrupted, the toys stored for a POI are
+    the ones written in all its datasets.
+
+        **Arguments:**
+
+            - **filename** name of the hdf5 file, opened in append mode
+            - **compression** (optionnal) compression filter of the datasets
+            - **seed** (optionnal) seed used to generate the toys, stored in
+            the attributes of the file
+
+        **Example:**
+            with ToyWriter("toys.hdf5") as writer:
+                writer.append(toys)
+                stored = writer.ntoys(toys.poigen)
+    """
+
+    def __init__(self, filename, compression=None, seed=None):
+        import h5py
+
+        self.filename = filename
+        self.compression = compression
+        self._file = h5py.File(filename, "a")
+
+        if seed is not None:
+            if self.seed is not None and self.seed != seed:
+                msg = "Toys in '{0}' are generated with the seed {1}, not {2}."
+                raise ValueError(msg.format(filename, self.seed, seed))
+            self._file.attrs["seed"] = seed
+
+    @property
+    def seed(self):
+        """
+        Returns the seed used to generate the toys of the file, None if
+        unknown.
+        """
+        seed = self._file.attrs.get("seed", None)
+        return None if seed is None else int(seed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def _find(group, key):
+        # datasets and groups are named after the values, i.e. '0' or '0.0'
+        for name in group.keys():
+            if name == key:
+                return name
+            try:
+                if float(name) == float(key):
+                    return name
+            except ValueError:
+                continue
+        return None
+
+    def _group(self, poigen, create=False):
+        name = self._find(self._file, float(poigen))
+        if name is not None:
+            return self._file[name]
+        elif create:
+            return self._file.create_group(str(float(poigen)))
+        else:
+            return None
+
+    def ntoys(self, poigen):
+        """
+        Returns the number of toys stored for **poigen**.
+        """
+        group = self._group(poigen)
+        if group is None:
+            return 0
+        sizes = [len(d) for g in group.values() for d in g.values()]
+        return min(sizes) if len(sizes) > 0 else 0
+
+    def append(self, toys):
+        """
+        Append the toys of the ToyResult **toys** to the file.
+        """
+        group = self._group(toys.poigen, create=True)
+        n = self.ntoys(toys.poigen)
+        columns = toys.to_dict()
+
+        if n > 0:
+            msg = "Toys for {0} '{1}' {2} in '{3}'."
+            for j, l in columns.items():
+                for o in l.keys():
+                    if j not in group or self._find(group[j], o) is None:
+                        raise ValueError(msg.format(j, o, "not stored",
+                                                    self.filename))
+            for j in group.keys():
+                for o in group[j].keys():
+                    if j not in columns or self._find(columns[j], o) is None:
+                        raise ValueError(msg.format(j, o, "missing",
+                                                    self.filename))
+
+        for j, l in columns.items():
+            if j not in group:
+                group.create_group(j)
+            for o, data in l.items():
+                name = self._find(group[j], o)
+                if name is None:
+                    group[j].create_dataset(str(o), data=data,
+                                            maxshape=(None,), chunks=True,
+                                            compression=self.compression)
+                else:
+                    dataset = group[j][name]
+                    dataset.resize((n + len(data),))
+                    dataset[n:] = data
+
+        self._file.flush()
+
+    def index(self, poigen):
+        """
+        Returns the indices of the toys stored for **poigen**, only their
+        column is read.
+        """
+        group = self._group(poigen)
+        n = self.ntoys(poigen)
+        if n == 0:
+            return np.arange(0)
+        if "index" in group["bestfit"]:
+            return group["bestfit"]["index"][:n]
+        else:
+            return np.arange(n)
+
+    def read(self, poigen, ntoys=None, index=None):
+        """
+        Returns a ToyResult with the first **ntoys** toys stored for
+        **poigen**, all of them if None. If **index** is given only the toys
+        with these indices are returned, sorted by index.
+        """
+        group = self._group(poigen)
+        n = self.ntoys(poigen)
+        if ntoys is not None:
+            n = min(n, ntoys)
+
+        rows = slice(0, n)
+        if index is not None:
+            selected = np.where(np.isin(self.index(poigen)[:n], index))[0]
+            if len(selected) > 0:
+                rows = slice(selected[0], selected[-1] + 1)
+                selected = selected - selected[0]
+            else:
+                rows = slice(0, 0)
+
+        toys = {}
+        for j, l in group.items():
+            toys[j] = {}
+            for o, data in l.items():
+                if j in ["nll", "weights"]:
+                    o = float(o)
+                toys[j][o] = data[rows]
+
+        result = ToyResult.from_dict(poigen, toys)
+        if index is not None:
+            result = result.select(selected)
+            result = result.select(np.argsort(result.index, kind="stable"))
+
+        return result
+
+
+def merge_toys(filenames, output, compression="gzip"):
+    """
+    Merge toy files, in the layout of FrequentistCalculator.toys_to_hdf5,
+    into a single compressed file. The files are read one generating POI at a
+    time, the toys generated for a POI must be evaluated at the same values
+    in all the files. If all the files are generated with the same seed, the
+    toys with the same index are duplicates and only written once.
+
+        **Arguments:**
+
+            - **filenames** list of names of the hdf5 files to merge
+            - **output** name of the merged file, created if it does not
+            exist
+            - **compression** compression filter of the datasets
+
+    Returns the number of toys written for each generating POI value.
+    """
+    import h5py
+
+    seeds = set()
+    for filename in filenames:
+        with h5py.File(filename, "r") as f:
+            seed = f.attrs.get("seed", None)
+            seeds.add(None if seed is None else int(seed))
+    seed = seeds.pop() if len(seeds) == 1 else None
+
+    seen = {}
+    written = {}
+
+    with ToyWriter(output, compression, seed) as writer:
+        for filename in filenames:
+            with h5py.File(filename, "r") as f:
+                for k, group in f.items():
+                    toys = LazyToyResult(group, float(k)).load()
+
+                    if seed is not None:
+                        if toys.poigen not in seen:
+                            index = writer.index(toys.poigen)
+                            seen[toys.poigen] = set(int(i) for i in index)
+                        seen_ = seen[toys.poigen]
+
+                        _, first = np.unique(toys.index, return_index=True)
+                        first = np.sort(first)
+                        new = [i not in seen_ for i in toys.index[first]]
+                        toys = toys.select(first[np.asarray(new, dtype=bool)])
+                        seen_.update(int(i) for i in toys.index)
+
+                    if len(toys) == 0:
+                        continue
+
+                    try:
+                        writer.append(toys)
+                    except ValueError as error:
+                        msg = "Cannot merge '{0}': {1}"
+                        raise ValueError(msg.format(filename, error))
+
+                    written[toys.poigen] = written.get(toys.poigen, 0)
+                    written[toys.poigen] += len(toys)
+
+    print("Toys successfully merged into '{0}' !".format(output))
+
+    return written
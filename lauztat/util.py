@@ -1,4 +1,5 @@
 from contextlib import ExitStack
+import numpy as np
 
 
 # def integrate_pdf(model, bounds, params):
@@ -46,6 +47,234 @@ def eval_pdf(model, x, params):
     return ret
 
 
+def pdf_evaluator(model, x):
+    """
+    Returns a function evaluating the pdf of **model** times its yield at
+    **x**, for the parameters values given in a dictionnary
+    {parameter: {"value": value}}. The evaluation of the pdf is built once
+    and reused for every call.
+    """
+    if "zfit" in str(model.__class__):
+        import zfit
+
+        op = model.pdf(x) * model.get_yield()
+
+        def eval_():
+            ret = zfit.run(op)
+            return ret
+    else:
+        raise NotImplementedError
+
+    deps = list(model.get_dependents())
+
+    def evaluate(params):
+        with ExitStack() as stack:
+            for p in deps:
+                value = params[p]["value"]
+                stack.enter_context(p.set_value(value))
+            ret = eval_()
+        return ret
+
+    return evaluate
+
+
+def eval_loss(loss, params):
+    """
+    Returns the value of the loss for the parameters values given in the
+    dictionnary **params** {parameter: value}.
+    """
+    if "zfit" in str(loss.__class__):
+        import zfit
+
+        def eval_(loss):
+            ret = zfit.run(loss.value())
+            return ret
+    else:
+        def eval_(loss):
+            return NotImplemented
+
+    with ExitStack() as stack:
+        for p, value in params.items():
+            stack.enter_context(p.set_value(value))
+        ret = eval_(loss)
+
+    return ret
+
+
+def get_values(params):
+    """
+    Returns a dictionnary with the current values of the parameters.
+    """
+    params = list(params)
+    if len(params) == 0:
+        return {}
+
+    if "zfit" in str(params[0].__class__):
+        import zfit
+        values = zfit.run(params)
+    else:
+        raise NotImplementedError
+
+    return dict(zip(params, values))
+
+
+def set_values(values):
+    """
+    Set the values of the parameters from a dictionnary {parameter: value}.
+    """
+    for p, v in values.items():
+        p.set_value(v)
+
+
+def get_all_values(models):
+    """
+    Returns a dictionnary with the current values of all the parameters of
+    **models**, the fixed ones included.
+    """
+    params = []
+    for m in models:
+        if "zfit" in str(m.__class__):
+            deps = m.get_dependents(only_floating=False)
+        else:
+            raise NotImplementedError
+        params.extend(p for p in deps if p not in params)
+
+    return get_values(params)
+
+
+def new_session(models, values):
+    """
+    Replace the session of the library of **models** by a new session, with
+    the parameters set to **values** returned by **get_all_values**. A
+    forked process can not use the session of its parent process.
+    """
+    if "zfit" in str(models[0].__class__):
+        import zfit
+        zfit.run.create_session(close_current=False)
+        for p in values.keys():
+            zfit.run.auto_initialize(p)
+        set_values(values)
+    else:
+        raise NotImplementedError
+
+
+def hesse_error(result, param):
+    """
+    Returns the uncertainty on **param** from the Hessian matrix at the
+    minimum **result**.
+    """
+    if "zfit" in str(result.__class__):
+        return result.hesse(params=[param])[param]["error"]
+    else:
+        raise NotImplementedError
+
+
+def set_seed(obj, seed):
+    """
+    Seed the random number generators of the library of **obj**, a model or
+    a sampler. With zfit only the samplers built after the call are seeded.
+    """
+    if "zfit" in str(obj.__class__):
+        import zfit
+        zfit.settings.set_seed(seed)
+    else:
+        raise NotImplementedError
+
+
+def sampler_evaluator(model, sampler):
+    """
+    Returns the limits (lower, upper) of the observables of **sampler** and
+    two functions, evaluated with the parameters at the values used to
+    resample **sampler** and **param** set to **value**:
+
+        - nevents(param, value, rng): the number of events to sample, drawn
+        with the numpy random Generator **rng** from the yield of an
+        extended **model**, otherwise the number of events of **sampler**
+        - pdf(x, param, value): the pdf of **model** at the points **x**, a
+        numpy array of shape (n, number of observables) loaded in the data
+        of **sampler**
+
+    The evaluations are built once.
+    """
+    if "zfit" in str(model.__class__):
+        import zfit
+
+        lower, upper = model.space.limits
+        if len(lower) != 1:
+            raise NotImplementedError
+        lower = np.asarray(lower[0], dtype=float)
+        upper = np.asarray(upper[0], dtype=float)
+
+        # the data of the sampler are initialized by a first resampling
+        sampler.resample()
+        pdf_op = model.pdf(sampler)
+        if model.is_extended:
+            nevents_op = model.get_yield()
+        else:
+            nevents_op = sampler.n_samples
+
+        def run(op, param, value):
+            values = {}
+            if not (param is None or value is None):
+                values[param] = value
+            values.update(sampler.fixed_params)
+            with ExitStack() as stack:
+                for p, v in values.items():
+                    stack.enter_context(p.set_value(v))
+                ret = zfit.run(op)
+            return ret
+
+        def nevents(param, value, rng):
+            n = run(nevents_op, param, value)
+            if model.is_extended:
+                n = rng.poisson(n)
+            return int(n)
+
+        def pdf(x, param, value):
+            load_sample(sampler, x)
+            return run(pdf_op, param, value)
+    else:
+        raise NotImplementedError
+
+    return lower, upper, nevents, pdf
+
+
+def get_sample(sampler):
+    """
+    Returns a copy of the data of **sampler**, a numpy array.
+    """
+    if "zfit" in str(sampler.__class__):
+        import zfit
+        return zfit.run(sampler.sample_holder)
+    else:
+        raise NotImplementedError
+
+
+def load_sample(sampler, sample):
+    """
+    Load in **sampler** the data **sample** returned by **get_sample**.
+    """
+    if "zfit" in str(sampler.__class__):
+        sampler.sample_holder.load(sample, session=sampler.sess)
+    else:
+        raise NotImplementedError
+
+
+def get_dataset(dataset):
+    """
+    Returns the values of **dataset**, a numpy array, and its weights, None
+    if the dataset is not weighted.
+    """
+    if "zfit" in str(dataset.__class__):
+        import zfit
+        weights = dataset.weights
+        if weights is not None and not isinstance(weights, np.ndarray):
+            weights = zfit.run(weights)
+        return zfit.run(dataset.value()), weights
+    else:
+        raise NotImplementedError
+
+
 def convert_dataset(dataset, array, weights=None):
     """
     dataset: only used to get the class in which array/weights will be
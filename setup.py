@@ -30,6 +30,12 @@ setup(name="lauztat",
       version="1.1.7",
       packages=find_packages(exclude=["tests"]),
       scripts=[],
+      entry_points={
+          "console_scripts": [
+              "lauztat-merge-toys=lauztat.cli:merge_toys_main",
+              "lauztat-toys=lauztat.cli:toys_main",
+              ],
+          },
       data_files=["README.rst"],
       description="Pure python statistic tools for high energy physics.",
       long_description=readme.replace(":math:", ""),
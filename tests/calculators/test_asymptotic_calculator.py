@@ -0,0 +1,99 @@
+#!/usr/bin/python
+import pytest
+
+from lauztat.calculators.asymptotic_calculator import asymov_binning
+from lauztat.calculators.asymptotic_calculator import adaptive_asymov_binning
+import numpy as np
+from scipy.stats import norm
+
+
+class Space(object):
+    limit1d = (0.1, 2.0)
+
+
+def test_asymov_binning():
+
+    centres, nodes, weights = asymov_binning(Space(), nbins=4, npoints=1)
+    assert centres == pytest.approx([0.3375, 0.8125, 1.2875, 1.7625])
+    assert nodes == pytest.approx(centres)
+    assert weights == pytest.approx(np.full(4, 0.475))
+
+    # a peak is integrated precisely with a handful of bins
+    centres, nodes, weights = asymov_binning(Space(), nbins=5, npoints=5)
+    yields = (norm.pdf(nodes, 1.2, 0.1) * weights).reshape(5, 5).sum(axis=1)
+    edges = np.linspace(0.1, 2.0, 6)
+    expected = np.diff(norm.cdf(edges, 1.2, 0.1))
+    assert yields == pytest.approx(expected, abs=1e-4)
+
+
+def test_adaptive_asymov_binning():
+
+    def f(x):
+        return 300 * np.exp(-2 * x) + 10 * norm.pdf(x, 1.2, 0.05)
+
+    centres, nodes, weights = asymov_binning(Space(), nbins=512, npoints=3)
+    edges = np.linspace(0.1, 2.0, 513)
+    f_nodes = f(nodes)
+    yields = (f_nodes * weights).reshape(512, 3).sum(axis=1)
+    flogf = (f_nodes * np.log(f_nodes) * weights).reshape(512, 3).sum(axis=1)
+
+    for tol in [1., 0.1]:
+        centres_, yields_ = adaptive_asymov_binning(edges, yields, flogf,
+                                                    f(edges), f(centres), tol)
+        nll = -np.sum(yields_ * np.log(f(centres_)))
+        assert nll == pytest.approx(-np.sum(flogf), abs=tol)
+        assert np.sum(yields_) == pytest.approx(np.sum(yields))
+        assert 8 <= len(centres_) < 512
+
+        # the bins are narrower around the peak
+        widths = np.diff(centres_)
+        assert np.min(widths[np.abs(centres_[:-1] - 1.2) < 0.1]) < \
+            np.max(widths)
+
+
+def test_cache_file_with_zfit(tmpdir):
+
+    import zfit
+    from zfit.core.loss import ExtendedUnbinnedNLL
+    from zfit.minimizers.minimizer_minuit import MinuitMinimizer
+    from lauztat.calculators import AsymptoticCalculator
+    from lauztat.config import Config
+    from lauztat.parameters import POI
+
+    obs = zfit.Space('x', limits=(0.1, 2.0))
+
+    mean = zfit.Parameter("m_acache", 1.2, 0.1, 2.)
+    sigma = zfit.Parameter("s_acache", 0.1, 0.02, 0.2)
+    nevents = zfit.Parameter("n_acache", 1000, 0, 5000)
+    model = nevents * zfit.pdf.Gauss(obs=obs, mu=mean, sigma=sigma)
+
+    def lossbuilder(model, data, weights=None):
+        loss = ExtendedUnbinnedNLL(model=model, data=data, fit_range=[obs])
+        return loss
+
+    def config(loc):
+        data = np.random.normal(loc, 0.1, 1000)
+        data = zfit.data.Data.from_numpy(obs=obs, array=data)
+        return Config(model, data, lossbuilder, MinuitMinimizer())
+
+    config1, config2 = config(1.2), config(1.25)
+    assert config1.fingerprint() == config1.fingerprint()
+    assert config1.fingerprint() != config2.fingerprint()
+
+    filename = str(tmpdir.join("asimov"))
+    poi, poialt = POI(mean, 1.22), POI(mean, 1.2)
+
+    calc1 = AsymptoticCalculator(config1, cache_file=filename)
+    nll1 = calc1.asymov_nll(poi, poialt)
+    calc1.close()
+
+    # the values of another configuration are not reused
+    calc2 = AsymptoticCalculator(config2, cache_file=filename)
+    assert calc2.asymov_nll(poi, poialt) != pytest.approx(nll1)
+    assert calc2.nfits == 1
+    calc2.close()
+
+    calc3 = AsymptoticCalculator(config1, cache_file=filename)
+    assert calc3.asymov_nll(poi, poialt) == pytest.approx(nll1)
+    assert calc3.nfits == 0
+    calc3.close()
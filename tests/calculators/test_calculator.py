@@ -5,6 +5,7 @@ from lauztat.calculators.calculator import Calculator
 from lauztat.config import Config
 from lauztat.parameters import POI
 import numpy as np
+import multiprocessing
 
 
 def test_constructors():
@@ -13,7 +14,11 @@ def test_constructors():
         Calculator()
 
 
-def test_with_zfit():
+fork = "fork" in multiprocessing.get_all_start_methods()
+requires_fork = pytest.mark.skipif(not fork, reason="fork is not available")
+
+
+def zfit_config(name):
 
     import zfit
     from zfit.core.loss import UnbinnedNLL
@@ -23,8 +28,8 @@ def test_with_zfit():
 
     obs = zfit.Space('x', limits=(0.1, 2.0))
 
-    mean = zfit.Parameter("mcalc", 1.2, 0.1, 2.)
-    sigma = zfit.Parameter("scalc", 0.1, 0.02, 0.2)
+    mean = zfit.Parameter("m" + name, 1.2, 0.1, 2.)
+    sigma = zfit.Parameter("s" + name, 0.1, 0.02, 0.2)
     model = zfit.pdf.Gauss(obs=obs, mu=mean, sigma=sigma)
 
     data_ = zfit.data.Data.from_numpy(obs=obs, array=data)
@@ -37,6 +42,14 @@ def test_with_zfit():
 
     config = Config(model, data_, lossbuilder, minimizer)
 
+    return config, mean
+
+
+def test_with_zfit():
+
+    config, mean = zfit_config("calc")
+    minimizer = config.minimizer
+
     calc = Calculator(config)
 
     assert calc.minimizer == minimizer
@@ -52,3 +65,65 @@ def test_with_zfit():
     assert calc.obs_nll(mean_poi[0]) == mean_nll[0]
     assert calc.obs_nll(mean_poi[1]) == mean_nll[1]
     assert calc.obs_nll(mean_poi[2]) == mean_nll[2]
+
+
+@requires_fork
+def test_parallel_with_zfit():
+
+    config, mean = zfit_config("calc_parallel")
+
+    mean_poi = POI(mean, [1.15, 1.2, 1.25])
+    mean_nll = Calculator(config).obs_nll(mean_poi)
+
+    calc = Calculator(config, n_workers=2)
+    assert calc.obs_nll(mean_poi) == pytest.approx(mean_nll)
+    assert calc.nfits == 3
+
+
+def test_fitcache():
+
+    from lauztat.calculators.calculator import FitCache
+
+    class Param(object):
+        name = "mu"
+
+    loss, param = object(), Param()
+
+    cache = FitCache()
+    assert cache.get(loss, param, 1.) is None
+    cache.put(loss, param, 1., -10.)
+    assert cache.get(loss, param, 1.) == -10.
+    assert cache.get(object(), param, 1.) is None
+    assert cache.hits == 1
+
+    cache.newtoy()
+    assert cache.get(loss, param, 1.) is None
+    assert cache.saved_per_toy == 1.
+
+
+def test_lrucache(tmpdir):
+
+    from lauztat.calculators.calculator import LRUCache
+
+    cache = LRUCache(maxsize=2)
+    cache[("mu", 1.)] = 10.
+    cache[("mu", 2.)] = 20.
+    assert cache[("mu", 1.)] == 10.
+    cache[("mu", 3.)] = 30.
+
+    assert len(cache) == 2
+    assert ("mu", 2.) not in cache
+    assert ("mu", 1.) in cache
+
+    filename = str(tmpdir.join("nll"))
+    cache = LRUCache(maxsize=1, filename=filename)
+    cache[("mu", 1.)] = 10.
+    cache[("mu", 2.)] = 20.
+    assert cache[("mu", 1.)] == 10.
+    cache.close()
+
+    cache = LRUCache(filename=filename)
+    assert cache[("mu", 2.)] == 20.
+    with pytest.raises(KeyError):
+        cache[("mu", 3.)]
+    cache.close()
@@ -1,10 +1,13 @@
 #!/usr/bin/python
 import pytest
 
-from lauztat.calculators import FrequentistCalculator
+from lauztat.calculators import FrequentistCalculator, SequentialStopping
+from lauztat.calculators import FitRecovery, ToyStats
 from lauztat.config import Config
 from lauztat.parameters import POI
+from lauztat.toys import ToyResult
 import numpy as np
+import multiprocessing
 
 
 def test_constructors():
@@ -12,10 +15,234 @@ def test_constructors():
     with pytest.raises(TypeError):
         FrequentistCalculator()
 
+    with pytest.raises(ValueError):
+        FitRecovery(strategies=["random"])
 
-# @pytest.mark.skip()
-def test_with_zfit():
 
+def test_fitrecovery():
+
+    recovery = FitRecovery()
+    recovery.converged = 6
+    recovery.recovered = 3
+    recovery.discarded = 1
+
+    summary = recovery.summary()
+    assert recovery.nfits == 10
+    assert summary["recovered_rate"] == pytest.approx(0.3)
+
+    recovery.reset()
+    assert recovery.nfits == 0
+    assert recovery.summary()["discarded_rate"] == 0.
+
+
+def test_toystats():
+
+    stats = ToyStats()
+    with stats.timer("scan"):
+        pass
+    stats.ntoys = 10
+    stats.cache.fits = 25
+    stats.walltime = 2.
+
+    other = ToyStats()
+    other.ntoys = 10
+    other.cache.fits = 15
+    other.recovery.converged = 10
+    stats.merge(other)
+
+    summary = stats.summary()
+    assert summary["time_scan"] >= 0.
+    assert summary["toys_per_second"] == pytest.approx(10.)
+    assert summary["fits_per_toy"] == pytest.approx(2.)
+    assert summary["converged"] == 10
+
+    stats.reset()
+    assert stats.summary()["ntoys"] == 0
+
+
+class Param(object):
+    name = "mu"
+    value = 1.
+
+    def set_value(self, value):
+        self.value = value
+
+
+class Minimum(object):
+
+    def __init__(self, converged, params):
+        self.converged = converged
+        self.params = params
+        self.fmin = 0.
+
+
+class StubMinimizer(object):
+    """
+    Minimizer whose fits converge as given by the list **converged**, and
+    then always.
+    """
+
+    def __init__(self, converged):
+        self.converged = list(converged)
+        self.calls = 0
+
+    def minimize(self, loss):
+        self.calls += 1
+        converged = self.converged.pop(0) if len(self.converged) > 0 else True
+        return Minimum(converged, {MU: {"value": 1.}})
+
+
+class StubConfig(object):
+    """
+    Configuration without model, whose toys are not sampled.
+    """
+    seed = None
+    models = []
+
+    def __init__(self, minimizer):
+        self.minimizer = minimizer
+        self.bestfit = Minimum(True, {MU: {"value": 1.}})
+
+    def pll(self, minimizer, loss, param, value):
+        return 0.
+
+    def sampler(self, floatting_params=None):
+        return []
+
+    def sample(self, sampler, ntoys, param=None, value=None, start=0,
+               attempt=0):
+        return iter(range(ntoys))
+
+    def nuisances(self, poiparam=None):
+        return []
+
+    def lossbuilder(self, models, data):
+        return "loss"
+
+    def deps_tobestfit(self):
+        pass
+
+
+MU = Param()
+
+
+def test_recovery():
+
+    # the first toy is recovered from the best fit values, the fits of the
+    # first sample of the second toy never converge
+    minimizer = StubMinimizer([False, True, False, False, False, False])
+    calc = FrequentistCalculator(StubConfig(minimizer))
+    toys = calc.dotoys(POI(MU, 1.), 3, [POI(MU, 1.5)])
+
+    summary = calc.stats.summary()
+    assert len(toys) == 3
+    assert summary["converged"] == 2
+    assert summary["recovered"] == 1
+    assert summary["discarded"] == 1
+    assert minimizer.calls == 8
+
+    # the fits of the samples and of the recovery are counted, with one
+    # profile fit per toy at 1.5, the one at the best fit being saved
+    assert summary["ntoys"] == 3
+    assert summary["fits"] == minimizer.calls + 3
+    assert summary["saved_per_toy"] == 1.
+    assert summary["time_bestfit"] > 0 and summary["time_weights"] == 0.
+
+    minimizer = StubMinimizer([False] * 100)
+    recovery = FitRecovery(strategies=["generated"], maxdiscard=3)
+    calc = FrequentistCalculator(StubConfig(minimizer), recovery=recovery)
+    with pytest.raises(RuntimeError):
+        calc.dotoys(POI(MU, 1.), 1, [POI(MU, 1.5)])
+
+    assert recovery.discarded == 3
+    assert recovery.recovered == 0
+    assert minimizer.calls == 6
+
+
+def test_streaming_thresholds():
+
+    calc = FrequentistCalculator(StubConfig(StubMinimizer([])), ntoysnull=20,
+                                 streaming={"batchsize": 10})
+    poinull = POI(MU, [1.])
+
+    # the summaries without threshold, e.g. of the expected p-values, are
+    # not used for the p-values at the observed values
+    calc.dotoys_streaming(None, poinull, printlevel=-1)
+    calc.dotoys_streaming(np.array([2.]), poinull, printlevel=-1)
+    assert len(calc.qsummaries) == 2
+    dist = calc.qdistribution(poinull[0], poinull[0], qobs=2.)
+    assert list(dist.thresholds) == [2.]
+    assert calc.qdistribution(poinull[0], poinull[0]).n == 20
+
+    pnull, _ = calc.pvalue_q(np.array([3.]), poinull)
+    assert len(calc.qsummaries) == 3 and pnull[0] == 0.
+
+    with pytest.raises(KeyError):
+        calc.qdistribution(poinull[0], poinull[0], qobs=4.)
+
+
+class StubCalculator(FrequentistCalculator):
+    """
+    Calculator whose toys are generated without fits, their best fit value
+    being their index.
+    """
+
+    def __init__(self, checkpoint):
+        self.config = Config.__new__(Config)
+        self.config.seed = 1
+        self.n_workers = 1
+        self.toysresults = {}
+        self.importance_shift = None
+        self.checkpoint = checkpoint
+        self.checkpoint_every = 30
+        self.generated = []
+
+    def dotoys(self, poigen, ntoys, poieval, printfreq=0.2, n_workers=None,
+               start=0, poiweight=None, checkpoint=None):
+        if checkpoint is not False:
+            return super(StubCalculator, self).dotoys(
+                poigen, ntoys, poieval, printfreq, n_workers, start,
+                poiweight, checkpoint)
+
+        index = np.arange(start, start + ntoys)
+        self.generated.extend(index)
+        nlls = np.zeros((ntoys, len(poieval)))
+        return ToyResult.from_arrays(poigen.value, index, index,
+                                     [p.value for p in poieval], nlls, index)
+
+
+def test_checkpoint(tmpdir):
+
+    filename = str(tmpdir.join("toys.hdf5"))
+    poi = POI(Param(), 1.)
+
+    calc = StubCalculator(filename)
+    calc.extend_toys(poi, 100, [poi])
+    calc.extend_toys(poi, 100, [poi])
+
+    toys = calc.toysresults[poi]
+    assert list(toys.index) == list(range(200))
+    assert list(toys.bestfit) == list(range(200))
+    assert len(calc.generated) == 200
+
+    # a new run reads the toys from the checkpoint
+    calc = StubCalculator(filename)
+    calc.extend_toys(poi, 100, [poi])
+    calc.extend_toys(poi, 150, [poi])
+
+    assert list(calc.toysresults[poi].index) == list(range(250))
+    assert calc.generated == list(range(200, 250))
+
+
+fork = "fork" in multiprocessing.get_all_start_methods()
+requires_fork = pytest.mark.skipif(not fork, reason="fork is not available")
+
+
+def zfit_config(name):
+    """
+    Returns a configuration fitting a gaussian, whose parameters names end
+    with **name**, and its mean.
+    """
     import zfit
     from zfit.core.loss import UnbinnedNLL
     from zfit.minimizers.minimizer_minuit import MinuitMinimizer
@@ -25,8 +252,8 @@ def test_with_zfit():
 
     obs = zfit.Space('x', limits=(0.1, 2.0))
 
-    mean = zfit.Parameter("m_fcalc", 1.2, 0.1, 2.5)
-    sigma = zfit.Parameter("s_fcalc", 0.1, 0.02, 0.2)
+    mean = zfit.Parameter("m_" + name, 1.2, 0.1, 2.5)
+    sigma = zfit.Parameter("s_" + name, 0.1, 0.02, 0.2)
     model = zfit.pdf.Gauss(obs=obs, mu=mean, sigma=sigma)
 
     data_ = zfit.data.Data.from_numpy(obs=obs, array=data)
@@ -54,6 +281,15 @@ def test_with_zfit():
     config = Config(model, data_, lossbuilder, minimizer, sampler=sampler,
                     sample_method=sampling)
 
+    return config, mean
+
+
+# @pytest.mark.skip()
+def test_with_zfit():
+
+    config, mean = zfit_config("fcalc")
+    minimizer = config.minimizer
+
     calc = FrequentistCalculator(config, ntoysnull=100, ntoysalt=100)
 
     assert calc.minimizer == minimizer
@@ -88,3 +324,110 @@ def test_with_zfit():
     calc2.readtoys_from_hdf5(mean, "toys.hdf5")
 
     calc.pvalue(poinull, poialt)
+
+    stopping = SequentialStopping(alpha=0.05, batchsize=20)
+    calc4 = FrequentistCalculator(config, ntoysnull=100, ntoysalt=100,
+                                  stopping=stopping)
+    pnull, palt, errors = calc4.pvalue(poinull, poialt, errors=True)
+
+    assert 20 <= errors["ntoysnull"][0] <= 100
+    assert errors["ntoysnull"][0] == calc4.ntoys(poinull)
+    assert errors["pnull"][0] > 0
+
+    calc5 = FrequentistCalculator(config, ntoysnull=50, importance_shift=0.005)
+    pnull, _, errors = calc5.pvalue(poinull, errors=True)
+
+    assert all(calc5.weights(poinull, poinull) > 0)
+    assert errors["pnull"][0] > 0
+
+    poinull = POI(mean, [1.19, 1.2, 1.21])
+    calc6 = FrequentistCalculator(config, ntoysnull=50, anchors=[1.2])
+    calc6.dotoys_null(poinull)
+
+    assert calc6.toysresults[poinull[0]] is calc6.toysresults[poinull[2]]
+    assert 0 < calc6.toysresults[poinull[0]].ess(1.19) <= 50
+    assert calc6.toysresults[poinull[1]].ess(1.2) == pytest.approx(50)
+
+    recovery = calc6.recovery
+    assert recovery.converged + recovery.recovered >= 50
+
+    calls = []
+    calc7 = FrequentistCalculator(config, callback=calls.append)
+    calc7.dotoys(POI(mean, 1.2), 10, poinull)
+    assert len(calls) > 0 and calls[0] is calc7.stats
+    assert calc7.stats.ntoys == 10
+    assert calc7.stats.fits_per_toy >= 1
+
+    calc8 = FrequentistCalculator(config, ntoysnull=30, ntoysalt=30,
+                                  streaming={"batchsize": 10})
+    qobs = calc8.qobs(poinull)
+    pnull, _ = calc8.pvalue_q(qobs, poinull)
+    assert len(calc8.toysresults) == 0
+    assert calc8.qdistribution(poinull[0], poinull[0]).n <= 30
+    assert all((pnull >= 0) & (pnull <= 1))
+
+
+@requires_fork
+def test_parallel_with_zfit():
+
+    config, mean = zfit_config("fcalc_parallel")
+    poinull = POI(mean, 1.2)
+    poialt = POI(mean, 1.6)
+
+    calc3 = FrequentistCalculator(config, n_workers=2)
+    toys = calc3.dotoys(poinull, 10, [poinull, poialt])
+
+    assert len(toys) == 10
+    assert len(toys.nll(poialt.value)) == 10
+    # each worker samples its own toys
+    assert not np.array_equal(toys.bestfit[:5], toys.bestfit[5:])
+
+    calc9 = FrequentistCalculator(config, pipeline=2)
+    toys = calc9.dotoys(poinull, 10, [poinull, poialt])
+    assert len(toys) == 10
+    assert calc9.stats.ntoys == 10
+    # each producer process samples its own toys
+    toys2 = calc9.dotoys(poinull, 10, [poinull, poialt])
+    assert not np.array_equal(toys.bestfit, toys2.bestfit)
+
+
+@requires_fork
+def test_seeded_with_zfit():
+
+    import zfit
+    from zfit.core.loss import ExtendedUnbinnedNLL
+    from zfit.minimizers.minimizer_minuit import MinuitMinimizer
+
+    data = np.random.normal(1.2, 0.1, 1000)
+
+    obs = zfit.Space('x', limits=(0.1, 2.0))
+
+    mean = zfit.Parameter("m_fseed", 1.2, 0.1, 2.5)
+    sigma = zfit.Parameter("s_fseed", 0.1, 0.02, 0.2)
+    nevents = zfit.Parameter("n_fseed", 1000, 0, 5000)
+    model = nevents * zfit.pdf.Gauss(obs=obs, mu=mean, sigma=sigma)
+
+    data_ = zfit.data.Data.from_numpy(obs=obs, array=data)
+
+    def lossbuilder(model, data, weights=None):
+        loss = ExtendedUnbinnedNLL(model=model, data=data, fit_range=[obs])
+        return loss
+
+    config = Config(model, data_, lossbuilder, MinuitMinimizer(), seed=1)
+
+    poigen = POI(mean, 1.2)
+    poieval = [POI(mean, 1.15), POI(mean, 1.25)]
+
+    serial = FrequentistCalculator(config).dotoys(poigen, 4, poieval)
+    calc = FrequentistCalculator(config, n_workers=2)
+    parallel = calc.dotoys(poigen, 4, poieval)
+    calc = FrequentistCalculator(config)
+    last = calc.dotoys(poigen, 2, poieval, start=2)
+
+    # the toy number i is the same whatever the processes or jobs
+    assert np.array_equal(serial.bestfit, parallel.bestfit)
+    assert np.array_equal(serial.nll(1.25), parallel.nll(1.25))
+    assert np.array_equal(serial.bestfit[2:], last.bestfit)
+    assert np.array_equal(serial.nll(1.15)[2:], last.nll(1.15))
+    assert list(last.index) == [2, 3]
+    assert len(np.unique(serial.bestfit)) == 4
@@ -72,3 +72,21 @@ def test_with_zfit():
     assert ra["band_m"] <= mean_bf <= ra["band_p"]
     assert ra["band_m"] == pytest.approx(1.1890518753693258, rel=0.01)
     assert ra["band_p"] == pytest.approx(1.2249924635033214, rel=0.01)
+
+    calc = AsymptoticCalculator(config)
+    ci = ConfidenceInterval(poinull, calc)
+    rr, rr2 = ci.interval_rootfinding([0.32, 0.05])
+    assert rr["band_m"] == pytest.approx(ra["band_m"], rel=0.01)
+    assert rr["band_p"] == pytest.approx(ra["band_p"], rel=0.01)
+    assert rr2["band_m"] < rr["band_m"] and rr2["band_p"] > rr["band_p"]
+
+    # a single value only gives the scale of the brackets
+    ci = ConfidenceInterval(POI(mean, 1.2), AsymptoticCalculator(config))
+    rr = ci.interval_rootfinding(0.32)
+    assert rr["band_m"] == pytest.approx(ra["band_m"], rel=0.01)
+    assert rr["band_p"] == pytest.approx(ra["band_p"], rel=0.01)
+
+    # the p-values of the toys are too noisy for the root finder
+    ci = ConfidenceInterval(poinull, FrequentistCalculator(config))
+    with pytest.raises(TypeError):
+        ci.interval_rootfinding()
@@ -73,6 +73,28 @@ def test_with_zfit():
         ul_test.plot()
         return ul_test.upperlimit()
 
+    def test_asy_rootfinding():
+        calc = AsymptoticCalculator(config)
+        ul_test = UpperLimit(poinull, poialt, calc, CLs=True, qtilde=False)
+        # the limit is below the values of poinull
+        poinull_ = POI(Nsig, value=np.linspace(20., 25., 3))
+        ul_test_ = UpperLimit(poinull_, poialt, calc, CLs=True, qtilde=False)
+        rr_ = ul_test_.upperlimit_rootfinding(xtol=1e-2)
+        assert rr_["observed"] == pytest.approx(16.17701, abs=0.5)
+        return ul_test.upperlimit_rootfinding(xtol=1e-2)
+
+    def test_asy_wald():
+        calc = AsymptoticCalculator(config, wald=True)
+        ul_test = UpperLimit(poinull, poialt, calc, CLs=True, qtilde=False)
+        diagnostic = calc.wald_diagnostic(poinull, npoints=3)
+        assert len(diagnostic["zdiff"]) == 3
+        # the diagnostic does not depend on the wald option
+        diagnostic_ = AsymptoticCalculator(config).wald_diagnostic(
+            poinull, npoints=3)
+        assert diagnostic_["q_wald"] == pytest.approx(diagnostic["q_wald"])
+        assert np.any(diagnostic_["zdiff"] > 0)
+        return ul_test.upperlimit()
+
     def test_freq():
         calc = FrequentistCalculator(config, ntoysnull=5000, ntoysalt=5000)
         calc.readtoys_from_hdf5(Nsig, "{0}/toys_UL_Nsig.hdf5".format(pwd))
@@ -81,8 +103,22 @@ def test_with_zfit():
         ul_test.plot_qdist(poinull[-1])
         return ul_test.upperlimit()
 
+    def test_adaptive():
+        # seeded, the limit from a few hundred toys is deterministic
+        seeded = Config(tot_model, data_, lossbuilder, MinuitMinimizer(),
+                        bestfit=config.bestfit, seed=12)
+        calc = FrequentistCalculator(seeded, ntoysnull=200, ntoysalt=200)
+        poinull_ = POI(Nsig, value=np.linspace(5.0, 25, 6))
+        ul_test = UpperLimit(poinull_, poialt, calc, CLs=True, qtilde=False)
+        ret = ul_test.adaptive_upperlimit(pilot=50, batchsize=50, rtol=0.05)
+        assert calc.ntoys(poinull_[0]) <= 200
+        return ret
+
     ra = test_asy()
+    rr = test_asy_rootfinding()
+    rw = test_asy_wald()
     rf = test_freq()
+    rad = test_adaptive()
 
     assert ra["observed"] == pytest.approx(16.17701, abs=0.5)
     assert ra["exp"] == pytest.approx(11.6035, abs=0.5)
@@ -97,3 +133,14 @@ def test_with_zfit():
     assert ra["exp_p2"] == pytest.approx(rf["exp_p2"], abs=2.0)
     assert ra["exp_m1"] == pytest.approx(rf["exp_m1"], abs=2.0)
     assert ra["exp_m2"] == pytest.approx(rf["exp_m2"], abs=2.0)
+
+    assert ra["observed"] == pytest.approx(rad["observed"], abs=3.0)
+
+    # one Brent search: a dozen p-values with an observed and an Asimov fit
+    # each, and an Asimov fit at the observed limit for the expected limits
+    assert rr["nfits"] <= 2 * 12 + 1
+    for k in ["observed", "exp", "exp_p1", "exp_p2", "exp_m1", "exp_m2"]:
+        assert rr[k] == pytest.approx(ra[k], abs=0.5)
+
+    assert rw["observed"] == pytest.approx(ra["observed"], abs=2.0)
+    assert rw["exp"] == pytest.approx(ra["exp"], abs=2.0)
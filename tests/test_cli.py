@@ -0,0 +1,80 @@
+#!/usr/bin/python
+import pytest
+
+from lauztat.cli import _shard, _load_config, toys_main
+from lauztat.toys import ToyWriter, merge_toys
+import numpy as np
+
+
+def test_shard():
+
+    shards = [_shard(10, j, 3) for j in range(3)]
+    assert shards == [(0, 4), (4, 3), (7, 3)]
+    assert _shard(2, 2, 3) == (2, 0)
+
+
+def test_load_config(tmpdir):
+
+    module = tmpdir.join("mymodel.py")
+    module.write("def config():\n    return 'myconfig'\n")
+
+    assert _load_config(str(module)) == "myconfig"
+
+    with pytest.raises(SystemExit):
+        toys_main([str(module), "toys.hdf5", "--poi", "mu", "--values", "1",
+                   "--ntoys", "10", "--job", "3", "--njobs", "2"])
+
+
+model = """
+import numpy as np
+import zfit
+from zfit.core.loss import ExtendedUnbinnedNLL
+from zfit.minimizers.minimizer_minuit import MinuitMinimizer
+from lauztat.config import Config
+
+obs = zfit.Space("x", limits=(0.1, 2.0))
+mu = zfit.Parameter("mu_cli", 1.2, 0.1, 2.5)
+sigma = zfit.Parameter("sigma_cli", 0.1, 0.02, 0.2)
+nevents = zfit.Parameter("n_cli", 500, 0, 2000)
+model = nevents * zfit.pdf.Gauss(obs=obs, mu=mu, sigma=sigma)
+data = zfit.data.Data.from_numpy(obs=obs,
+                                 array=np.random.normal(1.2, 0.1, 500))
+
+
+def lossbuilder(model, data, weights=None):
+    return ExtendedUnbinnedNLL(model=model, data=data, fit_range=[obs])
+
+
+config = Config(model, data, lossbuilder, MinuitMinimizer())
+"""
+
+
+def test_toys_main_with_zfit(tmpdir, monkeypatch):
+
+    # imported by name, so the jobs share the module and its parameters
+    tmpdir.join("toys_model.py").write(model)
+    monkeypatch.syspath_prepend(str(tmpdir))
+
+    def run(output, job, njobs):
+        output = str(tmpdir.join(output))
+        toys_main(["toys_model", output, "--poi", "mu_cli", "--values",
+                   "1.2", "--eval", "1.25", "--ntoys", "4", "--job",
+                   str(job), "--njobs", str(njobs), "--seed", "7"])
+        return output
+
+    outputs = [run("toys_{0}.hdf5".format(j), j, 2) for j in range(2)]
+    single = run("toys_single.hdf5", 0, 1)
+
+    merged = str(tmpdir.join("toys.hdf5"))
+    assert merge_toys(outputs, merged) == {1.2: 4}
+
+    with ToyWriter(merged) as writer:
+        toys = writer.read(1.2)
+    with ToyWriter(single) as writer:
+        reference = writer.read(1.2)
+
+    # the jobs generate the toys of a single job
+    assert list(toys.index) == [0, 1, 2, 3]
+    assert len(np.unique(toys.bestfit)) == 4
+    assert np.array_equal(toys.bestfit, reference.bestfit)
+    assert np.array_equal(toys.nll(1.25), reference.nll(1.25))
@@ -1,5 +1,5 @@
 import pytest
-from lauztat.config import Config
+from lauztat.config import Config, toy_seed, accept_reject
 import numpy as np
 
 
@@ -50,3 +50,32 @@ def test_with_zfit():
 
     with pytest.raises(StopIteration):
         next(toys)
+
+
+def test_toy_seed():
+
+    assert toy_seed(10, 1.2, 5) == toy_seed(10, 1.2, 5)
+    assert toy_seed(10, 1.2, 5) != toy_seed(11, 1.2, 5)
+    assert toy_seed(10, 1.2, 5) != toy_seed(10, 1.3, 5)
+    assert toy_seed(10, 1.2, 5) != toy_seed(10, 1.2, 6)
+    assert toy_seed(10, 1.2, 5) != toy_seed(10, 1.2, 5, attempt=1)
+    assert toy_seed(10, None, 5) == toy_seed(10, 0., 5)
+
+
+def test_accept_reject():
+
+    def pdf(x):
+        return np.exp(-0.5 * ((x[:, 0] - 1.) / 0.2)**2)
+
+    x = accept_reject(pdf, 0., 2., 20000, np.random.default_rng(3))
+
+    assert x.shape == (20000, 1)
+    assert np.all((x >= 0.) & (x <= 2.))
+    assert np.mean(x) == pytest.approx(1., abs=0.01)
+    assert np.std(x) == pytest.approx(0.2, abs=0.01)
+
+    y = accept_reject(pdf, 0., 2., 20000, np.random.default_rng(3))
+    assert np.array_equal(x, y)
+
+    rng = np.random.default_rng()
+    assert accept_reject(pdf, 0., 2., 0, rng).shape == (0, 1)
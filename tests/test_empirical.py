@@ -0,0 +1,83 @@
+#!/usr/bin/python
+import pytest
+
+from lauztat.empirical import EmpiricalDistribution, binomial_error
+from lauztat.empirical import StreamingDistribution
+import numpy as np
+
+
+def test_sf():
+
+    np.random.seed(0)
+    q = np.random.chisquare(1, 1000)
+    q[:10] = np.nan
+    q[10:20] = np.inf
+
+    dist = EmpiricalDistribution(q)
+    finite = q[~(np.isnan(q) | np.isinf(q))]
+
+    assert len(dist) == 980
+    assert all(np.diff(dist.values) >= 0)
+
+    qobs = np.array([0., 0.5, 1., 2.7, 100.])
+    expected = [len(finite[finite >= q_])/len(finite) for q_ in qobs]
+
+    assert dist.sf(qobs) == pytest.approx(expected)
+    assert dist.sf(1.) == pytest.approx(expected[2])
+    assert dist.sf_error(1.) == pytest.approx(binomial_error(expected[2],
+                                                             980))
+    assert dist.sf_error(100.) > 0
+
+
+def test_weighted_sf():
+
+    np.random.seed(1)
+    q = np.random.chisquare(1, 1000)
+    weights = np.random.uniform(0, 2, 1000)
+
+    dist = EmpiricalDistribution(q, weights)
+
+    x = weights * (q >= 1.)
+    assert dist.sf(1.) == pytest.approx(np.mean(x))
+    assert dist.sf_error(1.) == pytest.approx(np.std(x)/np.sqrt(1000))
+
+    assert dist.ess == pytest.approx(np.sum(weights)**2/np.sum(weights**2))
+
+    dist = EmpiricalDistribution(q, np.ones(1000))
+    assert dist.sf(1.) == pytest.approx(EmpiricalDistribution(q).sf(1.))
+    assert dist.ess == pytest.approx(1000)
+
+
+def test_streaming():
+
+    np.random.seed(2)
+    q = np.random.chisquare(1, 10000)
+    q[:2000] = 0.
+    weights = np.random.uniform(0, 2, 10000)
+
+    exact = EmpiricalDistribution(q, weights)
+
+    dist = StreamingDistribution(thresholds=[2.7])
+    for q_, w_ in zip(np.array_split(q, 7), np.array_split(weights, 7)):
+        dist.fill(q_, w_)
+
+    assert len(dist) == 10000
+    assert dist.sf(2.7) == pytest.approx(exact.sf(2.7))
+    assert dist.sf_error(2.7) == pytest.approx(exact.sf_error(2.7))
+    assert dist.sf(0.) == pytest.approx(exact.sf(0.))
+    assert dist.sf(1.5) == pytest.approx(exact.sf(1.5), abs=0.005)
+    assert dist.ess == pytest.approx(exact.ess)
+
+    dist = StreamingDistribution(thresholds=[2.7])
+    dist.fill(q[:5000])
+    other = StreamingDistribution(thresholds=[2.7])
+    other.fill(q[5000:])
+    dist.merge(other)
+
+    assert dist.sf(2.7) == pytest.approx(EmpiricalDistribution(q).sf(2.7))
+    assert dist.quantile(0.1) == 0.
+    assert dist.quantile(0.9) == pytest.approx(np.percentile(q, 90),
+                                               rel=0.01)
+
+    with pytest.raises(ValueError):
+        dist.merge(StreamingDistribution(thresholds=[1.]))
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+import pytest
+
+from lauztat.toys import ToyResult
+import numpy as np
+
+
+def test_toyresult():
+
+    toys = ToyResult(1.0, [1.0, 0.0, 2.0], 4, weighted=[0.5])
+
+    assert len(toys) == 4
+    assert toys.has(0.) and toys.has(2) and not toys.has(3.)
+
+    for i in range(4):
+        toys.fill(i, 1. + i, -i, [i, 10. + i, 20. + i], [0.1 * i])
+
+    assert all(toys.bestfit == [1., 2., 3., 4.])
+    assert all(toys.nll(0.) == [10., 11., 12., 13.])
+    assert toys.nll([2., 1.]).shape == (4, 2)
+    assert all(toys.nll([2., 1.])[:, 1] == toys.nll(1.))
+    assert toys.weight(0.5) == pytest.approx([0., 0.1, 0.2, 0.3])
+    assert toys.weight(1.0) is None
+    assert toys.ess(0.5) == pytest.approx(0.6**2 / 0.14)
+    assert toys.ess(1.0) == 4
+
+    with pytest.raises(KeyError):
+        toys.nll(3.)
+
+    other = ToyResult.from_dict(1.0, toys.to_dict())
+    other.index = other.index + 4
+    toys.append(other)
+
+    assert len(toys) == 8
+    assert all(toys.index == np.arange(8))
+    assert all(toys.nll(2.)[4:] == toys.nll(2.)[:4])
+    assert toys.weight(0.5).shape == (8,)
+
+    merged = ToyResult.concatenate([toys, other])
+    assert len(merged) == 12
+
+
+def test_toywriter(tmpdir):
+
+    from lauztat.toys import ToyWriter
+
+    filename = str(tmpdir.join("toys.hdf5"))
+
+    toys = ToyResult(0.0, [0.0, 1.0], 3)
+    for i in range(3):
+        toys.fill(i, 0.1 * i, -i, [i, 2. * i])
+
+    with ToyWriter(filename) as writer:
+        assert writer.ntoys(0.) == 0
+        writer.append(toys)
+        writer.append(toys)
+        assert writer.ntoys(0.) == 6
+
+    with ToyWriter(filename) as writer:
+        assert writer.ntoys(0.) == 6
+        read = writer.read(0., 4)
+        assert len(read) == 4
+        assert all(read.nll(1.) == [0., 2., 4., 0.])
+
+        wrong = ToyResult(0.0, [2.0], 3)
+        with pytest.raises(ValueError):
+            writer.append(wrong)
+
+
+def test_lazytoyresult(tmpdir):
+
+    import h5py
+    from lauztat.toys import LazyToyResult
+
+    filename = str(tmpdir.join("toys.hdf5"))
+
+    toys = ToyResult(0.0, [0.0, 1.0], 3, weighted=[0.5])
+    for i in range(3):
+        toys.fill(i, 0.1 * i, -i, [i, 2. * i], [1.])
+
+    with h5py.File(filename, "w") as f:
+        for j, l in toys.to_dict().items():
+            f.create_group(j)
+            for o, data in l.items():
+                f[j].create_dataset(str(o), data=data)
+
+    f = h5py.File(filename, "r")
+    lazy = LazyToyResult(f, 0.)
+
+    assert len(lazy) == 3
+    assert isinstance(lazy.nll(1.), np.memmap)
+    assert all(lazy.nll(1.) == toys.nll(1.))
+    assert lazy.nll([0., 1.]).shape == (3, 2)
+    assert all(lazy.weight(0.5) == 1.)
+    assert lazy.weight(0.) is None
+    assert all(lazy.load().bestfit == toys.bestfit)
+    f.close()
+
+
+def test_merge_toys(tmpdir):
+
+    from lauztat.toys import ToyWriter, merge_toys
+
+    def write(filename, start, evaluated=[0.0, 1.0]):
+        toys = ToyResult(0.0, evaluated, 4)
+        toys.index = np.arange(start, start + 4)
+        for i in range(4):
+            toys.fill(i, 0.1 * i, -i, [i] * len(evaluated))
+        with ToyWriter(filename, seed=42) as writer:
+            writer.append(toys)
+        return filename
+
+    f1 = write(str(tmpdir.join("toys_1.hdf5")), 0)
+    f2 = write(str(tmpdir.join("toys_2.hdf5")), 2)
+    f3 = write(str(tmpdir.join("toys_3.hdf5")), 8, [0.0])
+    output = str(tmpdir.join("toys.hdf5"))
+
+    written = merge_toys([f1, f2], output)
+    assert written == {0.0: 6}
+
+    with ToyWriter(output) as writer:
+        assert writer.seed == 42
+        toys = writer.read(0.)
+        assert all(toys.index == np.arange(6))
+        assert list(writer.index(0.)) == list(range(6))
+        assert len(writer.index(1.)) == 0
+
+    # the toys already stored in the output are not written again
+    assert merge_toys([f2], output) == {}
+
+    with pytest.raises(ValueError):
+        merge_toys([f3], output)